@@ -0,0 +1,279 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Benchmarks
+#--
+#-- Usage: python benchmark.py [-o results.json] [--quick]
+#--                            [--compare old.json] [workload...]
+#--
+#-- Every workload is run in a new process, so that the caches
+#-- are empty and the peak memory is its own
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import sys
+import gc
+import math
+import json
+import time
+import platform
+import argparse
+import subprocess
+import multiprocessing
+from pyooml import *
+import servos
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def sizeof(obj, seen):
+    """Memory used by the object and all the objects it references
+    (only the ones that have not been already counted in seen)"""
+
+    size = 0
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, type):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+
+    return size
+
+
+def memory_per_node(N=10000):
+    """Average memory used by every primitive of a point cloud of
+    N spheres, each one translated to its position"""
+
+    #-- Class level and shared data (the reference is kept, so
+    #-- that the ids are not reused)
+    base = set()
+    ref = sphere(1)
+    sizeof(ref, base)
+
+    nodes = [sphere(r=1, res=10).Tras([x, 20 * math.sin(x / 10.), 0])
+             for x in range(N)]
+    nodes_size = sizeof(nodes, base) - sys.getsizeof(nodes)
+
+    untransformed = [cube([1, 2, 3]) for x in range(N)]
+    untransformed_size = (sizeof(untransformed, base) -
+                          sys.getsizeof(untransformed))
+
+    print "Memory per primitive node (bytes)"
+    print "  translated sphere: {0:.1f}".format(nodes_size / float(N))
+    print "  untransformed cube: {0:.1f}".format(untransformed_size / float(N))
+
+
+#----------------- Workloads
+#-- Every workload returns the functions for building the parts
+#-- and for transforming them. The result is emitted with scad_gen()
+
+def points(N):
+    """Point cloud (like test_points in main.py)"""
+
+    def build():
+        return [point([x, 20 * math.sin(2 * math.pi * x / float(N)), 0])
+                for x in range(N)]
+
+    def transform(parts):
+        return union([p.Rot(30, [0, 0, 1]).Tras([0, 0, 10]) for p in parts])
+
+    return build, transform
+
+
+def grids(N):
+    """Grid of N x N cells"""
+
+    def build():
+        return grid(gsize=[10 * N, 10 * N], step=10)
+
+    def transform(g):
+        return g.Rot(45, [0, 0, 1]).Tras([5, 5, 0])
+
+    return build, transform
+
+
+def servo_rings(N):
+    """N servos with their rings"""
+
+    def build():
+        parts = []
+        for i in range(N):
+            s = servos.Futaba3003()
+            parts.append(servos.servo_ring(s) + s)
+        return parts
+
+    def transform(parts):
+        return union([p.Tras([60 * (i % 10), 40 * (i // 10), 0])
+                      for i, p in enumerate(parts)])
+
+    return build, transform
+
+
+def chain(N):
+    """Deep chain of additions: a + b + c + ..."""
+
+    def build():
+        obj = cube([1, 1, 1])
+        for i in range(1, N):
+            obj = obj + cube([1, 1, 1]).Tras([2 * i, 0, 0])
+        return obj
+
+    def transform(obj):
+        return obj.Rot(90, [1, 0, 0])
+
+    return build, transform
+
+
+def arms(N):
+    """Assembly of N arms placed with connectors (conn and Move)"""
+
+    def build():
+        arm = cube([5, 30, 10]) + conn(p=[-2.5, 10, 0], o=[1, 0, 0], ang=20)
+        targets = [conn(p=[100 * math.cos(2 * math.pi * i / N),
+                           100 * math.sin(2 * math.pi * i / N), 0],
+                        o=[math.cos(2 * math.pi * i / N),
+                           math.sin(2 * math.pi * i / N), 0])
+                   for i in range(N)]
+        return arm, targets
+
+    def transform(parts):
+        arm, targets = parts
+        d = conn(p=[-2.5, 10, 0], o=[1, 0, 0], ang=20)
+        return union([arm.Move(cs=d, ct=ct) for ct in targets])
+
+    return build, transform
+
+
+#-- Workloads and sizes
+WORKLOADS = [
+    ("points", points, [1000, 10000, 100000]),
+    ("grid", grids, [10, 100, 1000]),
+    ("servo_rings", servo_rings, [10, 100]),
+    ("chain", chain, [100, 1000, 5000]),
+    ("arms", arms, [100, 1000, 10000]),
+]
+
+#-- Sizes with --quick
+QUICK = {"points": [1000], "grid": [10], "servo_rings": [10],
+         "chain": [100], "arms": [100]}
+
+
+def peak_memory():
+    """Maximum resident memory of the process (KB). None if unknown"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_workload(args):
+    """Run the workload and return its measures. It is executed in
+    a new process"""
+
+    name, size = args
+    build, transform = dict((w[0], w[1]) for w in WORKLOADS)[name](size)
+    mem0 = peak_memory()
+
+    t0 = time.time()
+    parts = build()
+    t1 = time.time()
+    obj = transform(parts)
+    t2 = time.time()
+    code = obj.scad_gen()
+    t3 = time.time()
+
+    mem1 = peak_memory()
+    return {"workload": name, "size": size,
+            "build": t1 - t0, "transform": t2 - t1, "scad_gen": t3 - t2,
+            "scad_bytes": len(code),
+            "peak_kb": None if mem0 is None else mem1 - mem0}
+
+
+def run(workloads=None, quick=False):
+    """Run the workloads (list of names, None: all) and return the
+    list of results"""
+
+    tasks = [(name, size) for name, f, sizes in WORKLOADS
+             if workloads is None or name in workloads
+             for size in (QUICK[name] if quick else sizes)]
+
+    results = []
+    for task in tasks:
+        pool = multiprocessing.Pool(1)
+        try:
+            r = pool.apply(run_workload, (task,))
+        finally:
+            pool.terminate()
+        print "{workload:<12} {size:>7}  build {build:8.3f}s  transform " \
+              "{transform:8.3f}s  scad_gen {scad_gen:8.3f}s  " \
+              "{scad_bytes:>11} bytes  {peak_kb} KB".format(**r)
+        sys.stdout.flush()
+        results.append(r)
+
+    return results
+
+
+def git_commit():
+    """Current commit (None if unknown)"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, fname):
+    """Print the time ratios between the results and the ones in
+    the fname file (> 1: slower now)"""
+
+    with open(fname) as f:
+        old = dict(((r["workload"], r["size"]), r)
+                   for r in json.load(f)["results"])
+
+    print "Compared with {0}:".format(fname)
+    for r in results:
+        o = old.get((r["workload"], r["size"]))
+        if o is None:
+            continue
+        ratios = ["{0} x{1:.2f}".format(phase, r[phase] / max(o[phase], 1e-9))
+                  for phase in ("build", "transform", "scad_gen")]
+        print "{0:<12} {1:>7}  {2}".format(r["workload"], r["size"],
+                                           "  ".join(ratios))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pyooml benchmarks")
+    parser.add_argument("workloads", nargs="*",
+                        help="Workloads to run (default: all)")
+    parser.add_argument("-o", "--output", help="Save the results (json)")
+    parser.add_argument("--quick", action="store_true",
+                        help="Only the smallest sizes")
+    parser.add_argument("--compare", help="Previous results (json)")
+    parser.add_argument("--memory", action="store_true",
+                        help="Memory per primitive node")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_per_node()
+        sys.exit(0)
+
+    results = run(args.workloads or None, args.quick)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(),
+                       "python": platform.python_version(),
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": results}, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
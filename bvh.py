@@ -0,0 +1,196 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Bounding Volume Hierarchy: spatial index of the primitives
+#-- of an assembly, for fast overlap and proximity queries
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import heapq
+import numpy as np
+import transformations as trans
+
+
+class BVH(object):
+    """Bounding volume hierarchy built from the primitives of a part tree.
+    The leaves are identified by their index: self.parts[i] is the
+    primitive, self.matrices[i] its accumulated matrix and
+    self.boxes[i] its bounding box (in the coordinates of the root).
+    The debug parts are not included (see part.leaves())"""
+
+    def __init__(self, obj, leaf_size=4):
+        """
+        obj: Part tree
+        leaf_size: Maximum number of primitives in the leaf nodes
+        """
+
+        leaves = obj.leaves()
+        self.parts = [leaf for leaf, M in leaves]
+        self.leaf_size = leaf_size
+
+        if leaves:
+            self.matrices = np.array([M for leaf, M in leaves])
+            local = np.array([leaf._local_bbox() for leaf in self.parts])
+            self.boxes = trans.bboxes_transform(self.matrices, local)
+        else:
+            self.matrices = np.zeros((0, 4, 4))
+            self.boxes = np.zeros((0, 2, 3))
+
+        self._build()
+
+    def __len__(self):
+        return len(self.parts)
+
+    def _build(self):
+        """Build the tree. The primitives are split in two halves by
+        the median of their centers, on the longest axis"""
+
+        n = len(self.parts)
+        centers = self.boxes.mean(axis=1)
+        self.order = np.arange(n)
+
+        #-- Nodes: bounding box, childs (-1 in the leaves) and
+        #-- range of primitives (in self.order)
+        lo, hi, left, right, start, end = [], [], [], [], [], []
+
+        def new_node(s, e):
+            idx = self.order[s:e]
+            lo.append(self.boxes[idx, 0].min(axis=0))
+            hi.append(self.boxes[idx, 1].max(axis=0))
+            left.append(-1)
+            right.append(-1)
+            start.append(s)
+            end.append(e)
+            return len(lo) - 1
+
+        if n == 0:
+            self.lo = self.hi = np.zeros((0, 3))
+            self.left = self.right = self.start = self.end = []
+            return
+
+        pending = [new_node(0, n)]
+        while pending:
+            node = pending.pop()
+            s, e = start[node], end[node]
+            if e - s <= self.leaf_size:
+                continue
+
+            idx = self.order[s:e]
+            axis = np.argmax(np.ptp(centers[idx], axis=0))
+            mid = (e - s) // 2
+            self.order[s:e] = idx[np.argpartition(centers[idx, axis], mid)]
+
+            left[node] = new_node(s, s + mid)
+            right[node] = new_node(s + mid, e)
+            pending.extend([left[node], right[node]])
+
+        self.lo, self.hi = np.array(lo), np.array(hi)
+        self.left, self.right = left, right
+        self.start, self.end = start, end
+
+    def _overlap(self, a, b):
+        """True if the a and b nodes boxes overlap"""
+        return ((self.lo[a] <= self.hi[b]).all() and
+                (self.lo[b] <= self.hi[a]).all())
+
+    def query_box(self, box):
+        """Return the indexes of the primitives whose bounding boxes
+        intersect the box [[xmin, ymin, zmin], [xmax, ymax, zmax]]"""
+
+        box = np.asarray(box, dtype=float)
+        result = []
+        pending = [0] if len(self) else []
+        while pending:
+            node = pending.pop()
+            if not ((self.lo[node] <= box[1]).all() and
+                    (box[0] <= self.hi[node]).all()):
+                continue
+
+            if self.left[node] < 0:
+                idx = self.order[self.start[node]:self.end[node]]
+                b = self.boxes[idx]
+                mask = ((b[:, 0] <= box[1]).all(axis=1) &
+                        (box[0] <= b[:, 1]).all(axis=1))
+                result.extend(idx[mask])
+            else:
+                pending.extend([self.left[node], self.right[node]])
+
+        return sorted(result)
+
+    def query_part(self, obj):
+        """Return the indexes of the primitives whose bounding boxes
+        intersect the bounding box of the obj part (none if it is a
+        debug part)"""
+        box = None if obj.debug else obj.bbox()
+        if box is None:
+            return []
+        return self.query_box(box)
+
+    def nearest(self, p):
+        """Return the index of the primitive nearest to the point p
+        (distance to its bounding box) and the distance.
+        (None, inf) if there are no primitives"""
+
+        p = np.asarray(p, dtype=float)
+
+        def dist(lo, hi):
+            d = np.maximum(np.maximum(lo - p, 0), p - hi)
+            return np.sqrt((d * d).sum(axis=-1))
+
+        best, best_dist = None, np.inf
+        heap = [(dist(self.lo[0], self.hi[0]), 0)] if len(self) else []
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d >= best_dist:
+                break
+
+            if self.left[node] < 0:
+                idx = self.order[self.start[node]:self.end[node]]
+                dl = dist(self.boxes[idx, 0], self.boxes[idx, 1])
+                i = np.argmin(dl)
+                if dl[i] < best_dist:
+                    best, best_dist = idx[i], dl[i]
+            else:
+                for child in (self.left[node], self.right[node]):
+                    heapq.heappush(heap,
+                                   (dist(self.lo[child], self.hi[child]), child))
+
+        return best, best_dist
+
+    def overlap_pairs(self):
+        """Return the pairs of primitives (i, j), i < j, whose bounding
+        boxes overlap. They are the candidates for an interference check"""
+
+        pairs = []
+        pending = [(0, 0)] if len(self) else []
+        while pending:
+            a, b = pending.pop()
+            if not self._overlap(a, b):
+                continue
+
+            a_leaf, b_leaf = self.left[a] < 0, self.left[b] < 0
+
+            if a_leaf and b_leaf:
+                ia = self.order[self.start[a]:self.end[a]]
+                ib = self.order[self.start[b]:self.end[b]]
+                ba, bb = self.boxes[ia], self.boxes[ib]
+                mask = ((ba[:, np.newaxis, 0] <= bb[np.newaxis, :, 1]).all(axis=2) &
+                        (bb[np.newaxis, :, 0] <= ba[:, np.newaxis, 1]).all(axis=2))
+                for i, j in zip(*np.nonzero(mask)):
+                    i, j = ia[i], ib[j]
+                    if i < j or (a != b and i > j):
+                        pairs.append((min(i, j), max(i, j)))
+
+            elif a == b:
+                l, r = self.left[a], self.right[a]
+                pending.extend([(l, l), (r, r), (l, r)])
+
+            elif a_leaf or (not b_leaf and
+                            self.end[b] - self.start[b] > self.end[a] - self.start[a]):
+                #-- Split the biggest node
+                pending.extend([(a, self.left[b]), (a, self.right[b])])
+            else:
+                pending.extend([(self.left[a], b), (self.right[a], b)])
+
+        return sorted(pairs)
@@ -0,0 +1,227 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- (c)  Juan Gonzalez-Gomez  (Obijuan)
+#-- (c)  Alberto Valero
+#-- October-2012
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import os
+import time
+import errno
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Least Recently Used cache. When it is full, the entries that
+    have not been used for a longer time are discarded"""
+
+    def __init__(self, maxsize=256):
+        """
+        maxsize: Maximum number of entries. None means no limit.
+                 0 disables the cache
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+        #-- Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the value stored for key (or default)"""
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        #-- Move the entry to the end (most recently used)
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store the value for the given key"""
+        if self.maxsize == 0:
+            return
+
+        self._data.pop(key, None)
+        self._data[key] = value
+
+        #-- Discard the least recently used entries
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        """Change the maximum number of entries"""
+        self.maxsize = maxsize
+        if maxsize is not None:
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all the entries and reset the statistics"""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return the cache statistics"""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._data), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class DiskCache(object):
+    """Persistent cache of strings, stored in a directory (one file
+    per entry). It can be shared by several processes: the entries
+    are written in a temporal file and then renamed (atomic), and the
+    entries removed by other processes are just misses.
+    When the total size is over the limit, the least recently used
+    entries are removed (the file times are updated when they are read)"""
+
+    def __init__(self, path, maxbytes=256 << 20, version=""):
+        """
+        path: Directory of the cache (created if it does not exist)
+        maxbytes: Maximum size of the entries. None means no limit
+        version: Added to all the keys. When it changes, the previous
+                 entries are not used (and they are removed by the LRU)
+        """
+        self.path = path
+        self.maxbytes = maxbytes
+        self.version = version
+
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                #-- Created by another process
+                if e.errno != errno.EEXIST:
+                    raise
+
+        #-- Estimated size of the entries
+        self.size = self._scan()[0]
+        if maxbytes is not None and self.size > maxbytes:
+            self.evict()
+
+        #-- Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key):
+        name = hashlib.sha1(self.version + "\0" + key).hexdigest()
+        return os.path.join(self.path, name[:2], name[2:])
+
+    def get(self, key, default=None):
+        """Return the value stored for key (or default)"""
+        fname = self._file(key)
+        try:
+            with open(fname, "rb") as f:
+                value = f.read()
+            #-- Most recently used
+            os.utime(fname, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store the value for the given key"""
+        fname = self._file(key)
+        folder = os.path.dirname(fname)
+
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.rename(tmp, fname)
+
+        self.size += len(value)
+        if self.maxbytes is not None and self.size > self.maxbytes:
+            self.evict()
+
+    def _scan(self):
+        """Return the total size and the list of (time, size, file)
+        of the entries"""
+        entries = []
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                fname = os.path.join(root, name)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+
+                #-- Temporal files left by killed processes
+                if name.endswith(".tmp"):
+                    if time.time() - st.st_mtime > 3600:
+                        self._remove(fname)
+                    continue
+                entries.append((st.st_mtime, st.st_size, fname))
+        return sum(e[1] for e in entries), entries
+
+    def _remove(self, fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove the least recently used entries, until the size is
+        below 90% of the maximum (so that it is not done on every put)"""
+        size, entries = self._scan()
+        entries.sort()
+        limit = self.maxbytes * 0.9
+        for mtime, nbytes, fname in entries:
+            if size <= limit:
+                break
+            self._remove(fname)
+            size -= nbytes
+        self.size = size
+
+    def clear(self):
+        """Remove all the entries and reset the statistics"""
+        for mtime, nbytes, fname in self._scan()[1]:
+            self._remove(fname)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return the cache statistics"""
+        return {"hits": self.hits, "misses": self.misses,
+                "bytes": self.size, "maxbytes": self.maxbytes}
+
+
+def source_version(fnames):
+    """Hash of the content of the source files. It changes when any
+    of them is modified. The files are always read: the modification
+    times are not precise enough (same size edits in the same second)"""
+    h = hashlib.sha1()
+    for fname in sorted(set(fnames)):
+        try:
+            with open(fname, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            continue
+        h.update(fname + digest)
+    return h.hexdigest()
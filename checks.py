@@ -0,0 +1,269 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Checks of the caches and the code generation: the code of the
+#-- cached, parallel, modules and saved versions of a part tree
+#-- should be the same as the one of the plain generation
+#--
+#-- Usage: python checks.py [check...]
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import textwrap
+import traceback
+from contextlib import contextmanager
+import transformations as trans
+import pyooml
+from pyooml import *
+import combinational
+import scene
+
+
+def expect(cond, msg):
+    if not cond:
+        raise AssertionError(msg)
+
+
+@contextmanager
+def no_caches():
+    """Generate the code without the memory caches"""
+    pyooml.fragment_cache.resize(0)
+    combinational.geometry_cache.clear()
+    try:
+        yield
+    finally:
+        pyooml.fragment_cache.resize(None)
+
+
+def plain(obj, **kwargs):
+    with no_caches():
+        return obj.scad_gen(**kwargs)
+
+
+def inline(code):
+    """Replace the calls to the openscad modules by their definitions.
+    The comments and the spaces are removed"""
+    code = re.sub(r"//[^\n]*", "", code)
+
+    defs = {}
+    while True:
+        m = re.match(r"\s*module (\w+)\(\) \{", code)
+        if m is None:
+            break
+
+        #-- The body ends in the matching brace
+        depth, i = 1, m.end()
+        while depth:
+            depth += {"{": 1, "}": -1}.get(code[i], 0)
+            i += 1
+        defs[m.group(1)] = code[m.end():i - 1]
+        code = code[i:]
+
+    calls = re.compile(r"(\w+)\(\);")
+    while defs and calls.search(code):
+        code = calls.sub(lambda m: defs.get(m.group(1), m.group(0)), code)
+
+    return re.sub(r"\s+", "", code)
+
+
+def tree():
+    """Part tree with repeated combinational parts, shared subtrees,
+    colors and instances"""
+    screw = combinational.bcube([3, 3, 10], cr=1).color("gray")
+    plate = union([cube([40, 40, 2])] +
+                  [screw.Tras([x, y, 0]) for x in (-15, 15) for y in (-15, 15)])
+    holes = instances(cylinder(r=1, h=5), [trans.Tras([x, 0, 0])
+                                           for x in range(0, 30, 10)])
+    return union([plate, union([plate]).Tras([0, 0, 20]), holes,
+                  combinational.frame(l=10)] +
+                 [sphere(r=i + 1).Tras([i * 5, 50, 0]) for i in range(20)])
+
+
+#-- Checks
+
+def check_child_mutation():
+    """Modifying a part inside the tree invalidates the cached
+    code of its ancestors"""
+    pyooml.set_fragment_cache_size(None)
+    leaf = cube([1, 2, 3])
+    inner = union([leaf, sphere(r=2)])
+    obj = difference([cube([10, 10, 10]), inner.Tras([1, 0, 0])])
+
+    before = obj.scad_gen()
+    leaf.size = [4, 5, 6]
+    after = obj.scad_gen()
+    expect(after != before, "the cached code did not change")
+    expect(after == plain(obj), "the cached code is not the new one")
+
+    leaf.Tras([0, 0, 5])
+    expect(obj.scad_gen() == plain(obj), "a moved leaf is not updated")
+
+    inner.childs = inner.childs[:1]
+    expect(obj.scad_gen() == plain(obj), "the new childs are not updated")
+
+
+def check_jobs():
+    """The parallel generation has the same code as the serial one"""
+    obj = tree()
+    serial = plain(obj)
+    with no_caches():
+        expect(obj.scad_gen(jobs=2) == serial, "jobs=2 code is different")
+    expect(obj.scad_gen(jobs=4) == serial, "cached jobs=4 code is different")
+
+
+def check_modules():
+    """The code with openscad modules is the plain code when the
+    modules are inlined"""
+    obj = tree()
+    code = obj.scad_gen(modules=True)
+    expect("module " in code, "no modules were generated")
+    expect(inline(code) == inline(plain(obj)), "the modules code is different")
+    expect(obj.scad_gen(modules=True) == code, "the module names change")
+
+
+def check_scene():
+    """A saved scene has the same code and fingerprint as the original"""
+    obj = tree()
+    tmp = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmp, "tree.scene")
+        obj.save(fname)
+        loaded = scene.load(fname)
+        expect(plain(loaded) == plain(obj), "the loaded code is different")
+        expect(loaded.fingerprint() == obj.fingerprint(),
+               "the loaded fingerprint is different")
+    finally:
+        shutil.rmtree(tmp)
+
+
+class plate(combinational.combinational):
+    """Combinational part with a class level cmd"""
+
+    cmd = "plate"
+
+    def __init__(self, w):
+        self.w = w
+        super(plate, self).__init__(size=[w, w, 1])
+
+    def _geometry(self):
+        return cube([self.w, self.w, 1])
+
+
+def check_key_collision():
+    """Parts of the same class with different parameters do not share
+    their geometry (nor their openscad module)"""
+    obj = union([plate(10), plate(20).Tras([30, 0, 0]),
+                 plate(10).Tras([0, 30, 0]), plate(20).Tras([30, 30, 0])])
+    code = obj.scad_gen()
+    expect("cube([10, 10, 1]" in code and "cube([20, 20, 1]" in code,
+           "plate(10) and plate(20) have the same geometry")
+    expect(len(obj.scad_modules()) == 2, "plate(10) and plate(20) share module")
+    expect(inline(obj.scad_gen(modules=True)) == inline(code),
+           "the modules code is different")
+
+
+SCRIPT = """
+import parts
+with open("out.scad", "w") as f:
+    f.write(parts.holder().scad_gen())
+"""
+
+PARTS = """
+import helper
+from pyooml import *
+import combinational
+
+class holder(combinational.combinational):
+    cmd = "holder"
+
+    def __init__(self):
+        super(holder, self).__init__(size=None)
+
+    def _geometry(self):
+        return cube([helper.width(), 1, 1])
+"""
+
+
+def check_stale_helper():
+    """Modifying a helper module of the part classes (not reloaded by
+    the watcher) updates the code and the disk cache version"""
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.path.insert(0, tmp)
+    try:
+        #-- The watcher enables the disk cache when imported: a new one
+        pyooml.set_disk_cache(os.path.join(tmp, "cache"))
+        import watch
+
+        os.chdir(tmp)
+        sys.dont_write_bytecode = True
+        for name, code in (("script.py", SCRIPT), ("parts.py", PARTS),
+                           ("helper.py", "def width():\n    return 10\n")):
+            with open(name, "w") as f:
+                f.write(textwrap.dedent(code))
+
+        rebuilder = watch.Rebuilder("script.py")
+        rebuilder.run()
+        version = pyooml.code_version()
+        expect("cube([10, 1, 1]" in open("out.scad").read(), "no output")
+
+        with open("helper.py", "w") as f:
+            f.write("def width():\n    return 25\n")
+        rebuilder.changed("helper.py")
+        rebuilder.rebuild()
+        expect("cube([25, 1, 1]" in open("out.scad").read(),
+               "the old helper is used")
+        expect(pyooml.code_version() != version,
+               "the code version has not changed")
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(tmp)
+        sys.dont_write_bytecode = dont_write_bytecode
+        pyooml.set_disk_cache(None)
+        for name in ("parts", "helper"):
+            sys.modules.pop(name, None)
+        shutil.rmtree(tmp)
+
+
+CHECKS = [
+    ("child_mutation", check_child_mutation),
+    ("jobs", check_jobs),
+    ("modules", check_modules),
+    ("scene", check_scene),
+    ("key_collision", check_key_collision),
+    ("stale_helper", check_stale_helper),
+]
+
+
+def run(names=None):
+    """Run the checks (list of names, None: all). It returns the number
+    of failed checks"""
+    pyooml.set_fragment_cache_size(None)
+
+    failed = 0
+    for name, check in CHECKS:
+        if names and name not in names:
+            continue
+        try:
+            check()
+            print "{0:<16} ok".format(name)
+        except Exception:
+            failed += 1
+            print "{0:<16} FAILED".format(name)
+            traceback.print_exc()
+        sys.stdout.flush()
+
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run(sys.argv[1:]) else 0)
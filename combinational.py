@@ -8,17 +8,138 @@
 #-- GPL licence
 #-------------------------------------------------------------
 
+import types
+import hashlib
 import numpy as np
+import cache
+from contextlib import contextmanager
 from pyooml import *
 
+#-- Cache of the combinational parts geometry. The objects with
+#-- the same class and parameters share the same geometry
+geometry_cache = cache.LRUCache(maxsize=512)
+
+
+def set_geometry_cache_size(maxsize):
+    """Set the maximum number of geometries stored in the cache.
+    None means no limit. 0 disables the cache"""
+    geometry_cache.resize(maxsize)
+
+
+#-- Number of nested lazy() blocks
+_lazy = [0]
+
+
+@contextmanager
+def lazy():
+    """Lazy mode. Inside the with block the combinational parts are
+    created as deferred nodes: only their class and arguments are
+    stored. Ex:
+
+      with lazy():
+          designs = [servo_ring(s) for s in candidates]
+      designs[3].show()
+
+    Only the parts of the design that is shown are really built"""
+    _lazy[0] += 1
+    try:
+        yield
+    finally:
+        _lazy[0] -= 1
+
+
+@contextmanager
+def _eager():
+    """Disable the lazy mode (for building the real parts)"""
+    saved, _lazy[0] = _lazy[0], 0
+    try:
+        yield
+    finally:
+        _lazy[0] = saved
+
+
 class combinational(part):
-    def scad_gen(self, indent=0):
+
+    #-- Sub-assemblies: their code is stored in the disk cache
+    _persistent = True
+
+    def __new__(cls, *args, **kwargs):
+
+        #-- Lazy mode: the construction is deferred
+        if _lazy[0] and not issubclass(cls, deferred):
+            return deferred(cls, *args, **kwargs)
+
+        return super(combinational, cls).__new__(cls, *args, **kwargs)
+
+    def geometry(self):
+        """Return the object geometry. It is only built once for
+        all the objects of the same class and parameters"""
+
+        key = (self.__class__, self._geometry_key())
+        geo = geometry_cache.get(key)
+        if geo is None:
+            with _eager():
+                geo = self._geometry()
+            geometry_cache.put(key, geo)
+
+        return geo
+
+    def _geometry_key(self):
+        """Parameters that define the object geometry.
+        By default: all the public attributes of the object (the
+        parameters given to the constructor are usually stored in them).
+        The subclasses can return other keys, like self.cmd, if it
+        identifies the geometry"""
+        return _key(dict((name, value) for name, value in self.__dict__.items()
+                         if name[0] != "_"))
+
+    def _fingerprint_body(self):
+        #-- The geometry is defined by its parameters
+        return repr(_stable_key(self._geometry_key()))
+
+    def _module_name(self):
+        """Name of the openscad module of the geometry: the class name
+        and the hash of the class path and parameters. It is the same
+        in every run"""
+        cls = self.__class__
+        h = hashlib.md5("{0}.{1}".format(cls.__module__, cls.__name__))
+        h.update(self._fingerprint_body())
+        return "{0}_{1}".format(cls.__name__, h.hexdigest()[:8])
+
+    def _local_bbox(self):
+        geo = self.geometry()
+        return None if geo.debug else geo.bbox()
+
+    def _iter_leaves(self, M):
+        geo = self.geometry()
+        if geo.debug:
+            return iter([])
+        return geo._iter_leaves(M.dot(self.T))
+
+    def _iter_body(self, indent=0, modules=None, jobs=None):
+
+        #-- The geometry is defined in an openscad module
+        if modules:
+            key = (self.__class__, self._geometry_key())
+            if key in modules:
+                yield modules[key][0] + "();"
+                return
 
         #-- Get the object geometry
-        cad = self._geometry().scad_gen(indent)
-        
-        #-- Call the super-class scad_gen method
-        return super(combinational, self).scad_gen(indent,cad)
+        for chunk in self.geometry().iter_scad(indent, modules, jobs):
+            yield chunk
+
+    def _collect_modules(self, table):
+        key = (self.__class__, self._geometry_key())
+        if key in table:
+            table[key][0] += 1
+            return
+
+        #-- First time: the parts inside the geometry are only
+        #-- counted once, as it will be emitted once
+        geo = self.geometry()
+        table[key] = [1, geo, self._module_name()]
+        geo._collect_modules(table)
 
 
 class vector(combinational):
@@ -43,6 +164,9 @@ class vector(combinational):
         #-- Call the parent class constructor first
         super(vector, self).__init__(self.size)
 
+    def _geometry_key(self):
+        return (tuple(self.v), self.l_arrow, self.mark)
+
     def _geometry(self):
         """Build the vector geometry (combinational part)"""
 
@@ -95,6 +219,9 @@ class frame(combinational):
 
         #-- Call the parent class constructor first
         super(frame, self).__init__(self.size)
+
+    def _geometry_key(self):
+        return (self.l, self.l_arrow)
         
     def _geometry(self):
         z_axis = vector([0, 0, self.l], l_arrow=self.l_arrow).color("Blue")
@@ -118,6 +245,9 @@ class bcube(combinational):
         #-- Call the parent calls constructor
         super(bcube, self).__init__(size)
 
+    def _geometry_key(self):
+        return (tuple(self.size), self.cr, self.cres)
+
     def _geometry(self):
         """Expresion for building the object"""
 
@@ -126,12 +256,11 @@ class bcube(combinational):
             return cube(self.size)
 
         #-- Make sure the corner radius is not too big
-        if self.cr > min([self.size[0], self.size[1]]) / 2.:
-            self.cr = min([self.size[0], self.size[1]]) / 2.
+        cr = min([self.cr, min([self.size[0], self.size[1]]) / 2.])
 
         #-- Get the internal cube size
         sx, sy, sz = bsize = list(np.array(self.size) -
-                   2 * np.array([self.cr, self.cr, 0]))
+                   2 * np.array([cr, cr, 0]))
 
         #-- The cube cannot have lengths equal to 0
         if sx == 0:
@@ -141,7 +270,7 @@ class bcube(combinational):
             sy = 0.001
 
         #-- Use a cylinder for rounding. 
-        cyl = cylinder(r = self.cr, h = sz / 2.,
+        cyl = cylinder(r = cr, h = sz / 2.,
                        res = 4 * (self.cres + 1))
 
         #--  Place it at the first quadrant                                              
@@ -168,6 +297,9 @@ class point(combinational):
         
         #-- Call the parent clasa constructor first
         super(point, self).__init__(self.size)
+
+    def _geometry_key(self):
+        return (tuple(self.p), self.diam)
         
         
     def _geometry(self):
@@ -186,12 +318,14 @@ class grid(combinational):
         
         #-- Call the parent calls constructor first
         super(grid, self).__init__(self.size)
+
+    def _geometry_key(self):
+        return (tuple(self.gsize), self.step, self.width)
         
     def _geometry(self):
         linex = cube([self.gsize[0], self.width, self.width])
         sx,sy = self.gsize
-        lx = [linex.Tras([0,y,0]) for y in range(-sy/2, sy/2+self.step, self.step)]
-        lx = union(lx)
+        lx = instances(linex, [[0,y,0] for y in range(-sy/2, sy/2+self.step, self.step)])
         fig = (lx + lx.Rot(90, [0,0,1]))
         return fig.color("Gray")
 
@@ -200,18 +334,130 @@ class conn(combinational):
     
     def __init__(self, p, o = None, ang = 0.0):
         self.p = np.array(p)
-        self.o = o
+        self.o = None if o is None else np.array(o)
         self.ang = float(ang)
         self.cmd = "connector(p={0}, o={1}, ang={2})".format(p, o, ang)
         self.size = [1,1,1]
         #-- Call the parent calls constructor first
         super(conn, self).__init__(self.size)
+
+    def _geometry_key(self):
+        o = None if self.o is None else tuple(self.o)
+        return (tuple(self.p), o, self.ang)
         
     def _geometry(self):
         obj = point(self.p, diam=2.3).color("magenta")
-        if (self.o!=None):
-            self.o = np.array(self.o)
+        if (self.o is not None):
             obj += frame(l=5, l_arrow=2).Orien(v=self.o, roll=self.ang).Tras(self.p)
             
         return obj
     
+
+
+def _key(value):
+    """Hashable key of a value (parts, arrays and lists included)"""
+    if isinstance(value, part):
+        return value.fingerprint()
+    if isinstance(value, np.ndarray):
+        return tuple(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return tuple(_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _key(v)) for k, v in value.items()))
+    return value
+
+
+def _stable_key(key):
+    """The key with the functions and classes replaced by their module,
+    name, line and code version: their repr includes their address,
+    that changes in every run"""
+    if isinstance(key, tuple):
+        return tuple(_stable_key(k) for k in key)
+    if isinstance(key, (types.FunctionType, types.MethodType, type)):
+        func = getattr(key, "__func__", key)
+        code = getattr(func, "__code__", None)
+        return ("{0}.{1}".format(func.__module__, func.__name__),
+                code and code.co_firstlineno, object_version(func))
+    return key
+
+
+class deferred(combinational):
+    """Part whose construction is deferred. Only the class (or any
+    function returning a part) and its arguments are stored, and the
+    real part is built the first time it is needed: code, bounding box,
+    leaves or attributes (ex. the servo dimensions).
+    The real part is shared by the deferred nodes with the same
+    arguments. Its parameters can not be changed through this node"""
+
+    _caches = combinational._caches + ('_target', '_resolved')
+
+    def __init__(self, factory, *args, **kwargs):
+
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.cmd = "deferred({0})".format(getattr(factory, "__name__", factory))
+
+        #-- Call the parent class constructor. The size is the
+        #-- one of the real part
+        super(deferred, self).__init__(size=None)
+
+    def __getattr__(self, name):
+
+        #-- Only called for the attributes not found in this node:
+        #-- they are taken from the real part
+        if (name[0] == "_" or name in part.__slots__ or
+                "factory" not in self.__dict__):
+            raise AttributeError(name)
+        return getattr(self.target(), name)
+
+    def _geometry_key(self):
+        return (self.factory, _key(self.args), _key(self.kwargs))
+
+    def _geometry(self):
+        return self.factory(*self.args, **self.kwargs)
+
+    def _fingerprint_body(self):
+        return repr(_stable_key(self._geometry_key()))
+
+    def target(self):
+        """Return the real part, without the transformation and
+        color of this node"""
+        if self._target is None:
+            self._cache("_target", self.geometry())
+        return self._target
+
+    def resolve(self):
+        """Return the real part, with the transformation and color of
+        this node. It is only calculated once"""
+
+        if self._resolved is None:
+            obj = self.target()
+            colored = self.col != "" or self.col_rgb != [2, 2, 2]
+            if (self.T is not trans.IDENTITY or colored or
+                    self.debug or self.show_frame):
+                T = obj.T
+                obj = obj._clone()
+                obj.T = self.T.dot(T)
+                if colored:
+                    obj.col = self.col
+                    obj.col_rgb = self.col_rgb
+                    obj.alpha = self.alpha
+                obj.debug = obj.debug or self.debug
+                obj.show_frame = obj.show_frame or self.show_frame
+            self._cache("_resolved", obj)
+
+        return self._resolved
+
+    #-- Everything else is calculated from the real part
+    def iter_scad(self, indent=0, modules=None, jobs=None):
+        return self.resolve().iter_scad(indent, modules, jobs)
+
+    def bbox(self):
+        return self.resolve().bbox()
+
+    def _iter_leaves(self, M):
+        return self.resolve()._iter_leaves(M)
+
+    def _collect_modules(self, table):
+        self.resolve()._collect_modules(table)
@@ -0,0 +1,282 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Instrumentation: number of calls and time spent per class
+#-- in the construction, transformation, geometry and openscad
+#-- generation of the parts. The time of the openscad generation
+#-- is measured per object, without the time of its childs.
+#--
+#-- It is disabled by default (no overhead). Enable it with:
+#--
+#--   with instrument.profiling():
+#--       ...build the design...
+#--   instrument.report()
+#--
+#-- or with the PYOOML_PROFILE environment variable:
+#--   PYOOML_PROFILE=1 python main.py           (report at exit)
+#--   PYOOML_PROFILE=trace.json python main.py  (+ chrome trace)
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import os
+import sys
+import json
+import atexit
+from timeit import default_timer as clock
+from contextlib import contextmanager
+
+import pyooml
+import transformations as trans
+
+#-- Methods instrumented in every part class, by phase. Only the
+#-- outer call is measured when a method calls the same phase of
+#-- the same object (ex. the constructors calling super())
+PHASES = [
+    ("construct", ["__init__"]),
+    ("transform", ["Tras", "Rot", "Orien", "Move", "color"]),
+    ("clone", ["_clone"]),
+    ("geometry", ["_geometry"]),
+    ("output", ["scad_gen", "write_scad", "show"]),
+]
+
+#-- Generator methods, by phase. The time is the one spent inside
+#-- the generator of every object, without the time of the nested
+#-- generators of the same phase (the childs). The code of the childs
+#-- generated in other processes (jobs) is not measured
+GENERATORS = [
+    ("scad_gen", ["_iter_scad"]),
+]
+
+#-- Functions of the transformations module (math)
+FUNCTIONS = ["Rot", "rotation", "Orien"]
+
+#-- Statistics: (phase, name) -> [calls, seconds, bytes]
+stats = {}
+
+#-- Trace events: (phase, name, start, duration)
+events = []
+
+#-- Maximum number of trace events stored
+max_events = 1000000
+
+#-- (phase, object id) of the calls being measured
+_active = set()
+
+#-- Time of the nested generators, for each generator being executed
+_nested = []
+
+#-- Original methods: (owner, attribute, original)
+_patched = []
+_classes = set()
+_trace = False
+
+
+def _record(phase, name, t0, dt, nbytes=0, span=None):
+    """span: duration of the trace event (default: dt)"""
+    entry = stats.get((phase, name))
+    if entry is None:
+        entry = stats[(phase, name)] = [0, 0., 0]
+    entry[0] += 1
+    entry[1] += dt
+    entry[2] += nbytes
+    if _trace and len(events) < max_events:
+        events.append((phase, name, t0, dt if span is None else span))
+
+
+def _sizeof(obj):
+    """Bytes allocated by a shallow copy (the object and its dict)"""
+    size = sys.getsizeof(obj)
+    d = getattr(obj, "__dict__", None)
+    if d is not None:
+        size += sys.getsizeof(d)
+    return size
+
+
+def _wrap_method(phase, func):
+    def wrapper(self, *args, **kwargs):
+        key = (phase, id(self))
+        if key in _active:
+            return func(self, *args, **kwargs)
+
+        _active.add(key)
+        t0 = clock()
+        try:
+            result = func(self, *args, **kwargs)
+        finally:
+            dt = clock() - t0
+            _active.discard(key)
+
+        nbytes = _sizeof(result) if phase == "clone" else 0
+        _record(phase, type(self).__name__, t0, dt, nbytes)
+        return result
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _wrap_generator(phase, func):
+    def wrapper(self, *args, **kwargs):
+        gen = func(self, *args, **kwargs)
+        start, end, total = None, None, 0.
+        while True:
+            _nested.append(0.)
+            t0 = clock()
+            try:
+                chunk = next(gen)
+            except StopIteration:
+                break
+            finally:
+                end = clock()
+                dt = end - t0
+                nested = _nested.pop()
+                if _nested:
+                    _nested[-1] += dt
+                total += dt - nested
+                if start is None:
+                    start = t0
+            yield chunk
+
+        _record(phase, type(self).__name__, start, total, span=end - start)
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _wrap_function(phase, name, func):
+    def wrapper(*args, **kwargs):
+        t0 = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(phase, name, t0, clock() - t0)
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _patch(owner, attr, value):
+    _patched.append((owner, attr, owner.__dict__[attr]))
+    setattr(owner, attr, value)
+
+
+def _instrument_class(cls):
+    """Instrument the methods defined in the cls class and its bases"""
+    for c in cls.__mro__:
+        if c in _classes or not issubclass(c, pyooml.part):
+            continue
+        _classes.add(c)
+        for phase, names in PHASES:
+            for name in names:
+                if name in c.__dict__:
+                    _patch(c, name, _wrap_method(phase, c.__dict__[name]))
+        for phase, names in GENERATORS:
+            for name in names:
+                if name in c.__dict__:
+                    _patch(c, name, _wrap_generator(phase, c.__dict__[name]))
+
+
+def enable(trace=True):
+    """Start measuring.
+    trace: store the events for write_trace() too"""
+    global _trace
+
+    _trace = trace
+    if _patched:
+        return
+
+    #-- The classes are instrumented the first time an object is
+    #-- created, so that the classes defined by the user (after
+    #-- enabling) are measured too
+    new = pyooml.part.__new__
+
+    def __new__(cls, *args, **kwargs):
+        if cls not in _classes:
+            _instrument_class(cls)
+        return new(cls, *args, **kwargs)
+
+    _patch(pyooml.part, "__new__", staticmethod(__new__))
+    _patch(pyooml.transform, "apply",
+           _wrap_method("transform", pyooml.transform.apply))
+    for name in FUNCTIONS:
+        _patch(trans, name, _wrap_function("math", name, getattr(trans, name)))
+
+
+def disable():
+    """Stop measuring: the original methods are restored"""
+    while _patched:
+        owner, attr, original = _patched.pop()
+        setattr(owner, attr, original)
+    _classes.clear()
+    _active.clear()
+    del _nested[:]
+
+
+def reset():
+    """Clear the statistics and events"""
+    stats.clear()
+    del events[:]
+
+
+@contextmanager
+def profiling(trace=True):
+    """Measure the code inside the with block"""
+    enable(trace)
+    try:
+        yield stats
+    finally:
+        disable()
+
+
+def report(stream=None, top=None):
+    """Print the statistics, sorted by total time.
+    top: maximum number of lines (None: all)"""
+
+    stream = stream or sys.stdout
+    rows = sorted(stats.items(), key=lambda item: -item[1][1])
+    if top is not None:
+        rows = rows[:top]
+
+    stream.write("{0:<10} {1:<20} {2:>9} {3:>11} {4:>10} {5:>12}\n".format(
+                 "phase", "class", "calls", "total(ms)", "mean(us)",
+                 "bytes"))
+    for (phase, name), (calls, seconds, nbytes) in rows:
+        stream.write("{0:<10} {1:<20} {2:>9} {3:>11.3f} {4:>10.2f} {5:>12}\n"
+                     .format(phase, name, calls, seconds * 1e3,
+                             seconds * 1e6 / calls, nbytes or ""))
+
+
+def write_trace(fname):
+    """Write the events in the chrome trace format (chrome://tracing).
+    The calls of the same phase can be nested"""
+
+    pid = os.getpid()
+    trace = [{"name": name, "cat": phase, "ph": "X", "pid": pid, "tid": 0,
+              "ts": t0 * 1e6, "dur": dt * 1e6}
+             for phase, name, t0, dt in events]
+
+    with open(fname, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def enable_from_env():
+    """Enable the instrumentation if PYOOML_PROFILE is set. The
+    report is printed at exit, and if the variable is a .json file
+    name, the trace is written into it"""
+
+    value = os.environ.get("PYOOML_PROFILE")
+    if not value:
+        return
+
+    fname = value if value.endswith(".json") else None
+    enable(trace=fname is not None)
+
+    def dump():
+        report(sys.stderr)
+        if fname:
+            write_trace(fname)
+
+    atexit.register(dump)
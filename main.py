@@ -65,33 +65,15 @@ def test_difference_1():
     c2 = cylinder(r=3, h=c1.size[2]+10)
     (c1-c2).show()
 
-def servo_ring(servo):
-    
-    thick_z = 4
-    thick_xy = servo.ear_size[0] + 4
-    tolerance = 0.2
-    
-    #-- Get the servo body dimensions
-    sx, sy, sz = servo.body_size + np.array([tolerance, tolerance, 0])
-    
-    #-- Cutout: servo body + tolerance
-    cutout = bcube([sx, sy, sz],cr = servo.body_cr, cres = servo.body_cres)
-    
-    #-- Add the tolerance to the 
-    
-    obj = bcube([sx + 2*thick_xy + 2*tolerance, sy + thick_xy + 2*tolerance, thick_z])
-    
-    return (obj - cutout - servo.drills(dh=10)).Tras([0,0,-thick_z/2 + servo.ear_hi_center])
-
 def test_servo_ring_1():
     
     #-- Create a "ring" part for the first servo
     s1 = servos.Futaba3003()
-    sr1 = servo_ring(s1)
+    sr1 = servos.servo_ring(s1)
 
     #-- Create a "ring" for another servo
     s2 = servos.TowerProSG90()
-    sr2 = servo_ring(s2)
+    sr2 = servos.servo_ring(s2)
 
     #-- Show the objetcs (servos + rings)
     obj1 = (sr1 + s1).Tras([0, 30, s1.body_size[2]/2.])
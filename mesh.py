@@ -0,0 +1,235 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Mesh backend: tessellation of the primitives into triangles,
+#-- without using openscad
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import io
+import numpy as np
+from collections import OrderedDict
+import cache
+import pyooml
+from pyooml import *
+
+#-- Cache of the tessellated primitives, by openscad command
+tessellation_cache = cache.LRUCache(maxsize=256)
+
+
+class Mesh(object):
+    """Triangle mesh. vertices: (N,3) array. faces: (M,3) array of
+    vertex indexes (counter clockwise seen from outside)"""
+
+    def __init__(self, vertices, faces):
+        self.vertices = vertices
+        self.faces = faces
+
+    def triangles(self):
+        """Return the (M,3,3) array of triangles"""
+        return self.vertices[self.faces]
+
+    def normals(self):
+        """Return the unit normals of the triangles"""
+        t = self.triangles()
+        n = np.cross(t[:, 1] - t[:, 0], t[:, 2] - t[:, 0])
+        norm = np.linalg.norm(n, axis=1)
+        norm[norm == 0] = 1.
+        return n / norm[:, np.newaxis]
+
+    def area(self):
+        """Surface area"""
+        t = self.triangles()
+        n = np.cross(t[:, 1] - t[:, 0], t[:, 2] - t[:, 0])
+        return np.linalg.norm(n, axis=1).sum() / 2.
+
+    def volume(self):
+        """Enclosed volume (the sum of the volumes of the closed parts)"""
+        t = self.triangles()
+        return np.einsum('ij,ij->i', t[:, 0], np.cross(t[:, 1], t[:, 2])).sum() / 6.
+
+    def bbox(self):
+        """Bounding box: [[xmin, ymin, zmin], [xmax, ymax, zmax]]"""
+        return np.array([self.vertices.min(axis=0), self.vertices.max(axis=0)])
+
+
+#----------------- Tessellation of the primitives
+
+def _fragments(res):
+    """Number of fragments of a circle of resolution res ($fn)"""
+    return max(int(res), 3)
+
+def _circle(r, n, z):
+    """n points of a circle of radius r at the height z"""
+    a = 2 * np.pi * np.arange(n) / n
+    return np.column_stack([r * np.cos(a), r * np.sin(a), np.full(n, z)])
+
+def _band(lo, hi, n):
+    """Triangles joining the rings of n vertices that start at the
+    lo (lower) and hi (upper) indexes"""
+    i = np.arange(n)
+    j = (i + 1) % n
+    return np.concatenate([
+        np.column_stack([lo + i, lo + j, hi + j]),
+        np.column_stack([lo + i, hi + j, hi + i])])
+
+def _cap(start, n, up):
+    """Triangles closing a ring of n vertices (fan).
+    up: True if the normal points to +z"""
+    i = np.arange(1, n - 1)
+    if up:
+        return np.column_stack([np.full(n - 2, start), start + i, start + i + 1])
+    return np.column_stack([np.full(n - 2, start), start + i + 1, start + i])
+
+def tessellate_cube(size):
+    sx, sy, sz = np.array(size, dtype=float) / 2.
+    V = np.array([[x, y, z] for x in (-sx, sx) for y in (-sy, sy)
+                            for z in (-sz, sz)])
+    F = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5],
+                  [0, 4, 5], [0, 5, 1], [2, 3, 7], [2, 7, 6],
+                  [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    return V, F
+
+def tessellate_frustum(h, r1, r2, res):
+    """Cylinders and cones (centered). r1: bottom radius. r2: top radius"""
+    n = _fragments(res)
+    V = np.concatenate([_circle(r1, n, -h / 2.), _circle(r2, n, h / 2.)])
+    F = np.concatenate([_band(0, n, n), _cap(n, n, True), _cap(0, n, False)])
+    return V, F
+
+def tessellate_sphere(r, res):
+    """Sphere, with the same rings than openscad"""
+    n = _fragments(res)
+    rings = (n + 1) // 2
+    phi = np.pi * (np.arange(rings) + 0.5) / rings
+
+    #-- Rings from the top to the bottom
+    V = np.concatenate([_circle(r * np.sin(p), n, r * np.cos(p)) for p in phi])
+    F = [_cap(0, n, True), _cap((rings - 1) * n, n, False)]
+    F += [_band((k + 1) * n, k * n, n) for k in range(rings - 1)]
+    return V, np.concatenate(F)
+
+def tessellate(prim):
+    """Return the (vertices, faces) of a primitive, in its own
+    coordinates (its matrix is not applied)"""
+
+    key = prim.cmd
+    result = tessellation_cache.get(key)
+    if result is not None:
+        return result
+
+    if isinstance(prim, cube):
+        result = tessellate_cube(prim.size)
+    elif isinstance(prim, cylinder):
+        result = tessellate_frustum(prim.h, prim.r, prim.r, prim.res)
+    elif isinstance(prim, cone):
+        result = tessellate_frustum(prim.h, prim.r1, prim.r2, prim.res)
+    elif isinstance(prim, sphere):
+        result = tessellate_sphere(prim.r, prim.res)
+    else:
+        raise TypeError("Primitive not supported: {0}".format(prim.cmd))
+
+    tessellation_cache.put(key, result)
+    return result
+
+
+#----------------- Meshes of part trees
+
+def check_union(obj):
+    """Raise ValueError if the tree has operators that can not be
+    calculated by joining the meshes of the primitives"""
+
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if o.debug and o is not obj:
+            #-- Not meshed (see leaves())
+            continue
+        if isinstance(o, (difference, minkowski)):
+            raise ValueError("{0} is not supported by the mesh backend: "
+                             "use openscad".format(o.cmd))
+        if isinstance(o, operator):
+            pending.extend(o.childs)
+        elif isinstance(o, combinational):
+            pending.append(o.geometry())
+
+def mesh(obj):
+    """Return the Mesh of a part tree made of unions of (transformed)
+    primitives. The meshes of the primitives are just joined, so the
+    parts should not overlap. The debug parts (background in openscad)
+    are not included.
+    The meshes are stored in the disk cache, if enabled with meshes=True
+    (see pyooml.set_disk_cache())"""
+
+    store = pyooml.disk_cache if pyooml.disk_cache_meshes else None
+    if store is None:
+        return _mesh(obj)
+
+    key = "mesh-" + obj.fingerprint()
+    data = store.get(key)
+    if data is not None:
+        arrays = np.load(io.BytesIO(data))
+        return Mesh(arrays["vertices"], arrays["faces"])
+
+    m = _mesh(obj)
+    buf = io.BytesIO()
+    np.savez(buf, vertices=m.vertices, faces=m.faces)
+    store.put(key, buf.getvalue())
+    return m
+
+def _mesh(obj):
+    check_union(obj)
+
+    #-- Group the primitives with the same tessellation, so that
+    #-- each group is transformed with one matrix operation
+    groups = OrderedDict()
+    for prim, M in obj.leaves():
+        groups.setdefault(prim.cmd, (prim, []))[1].append(M)
+
+    vertices, faces = [], []
+    nv = 0
+    for prim, Ms in groups.values():
+        V, F = tessellate(prim)
+        Ms = np.array(Ms)
+
+        #-- (k, v, 3): the v vertices transformed by the k matrices
+        Vk = (np.einsum('kij,vj->kvi', Ms[:, :3, :3], V) +
+              Ms[:, np.newaxis, :3, 3])
+        offsets = nv + len(V) * np.arange(len(Ms))
+
+        vertices.append(Vk.reshape(-1, 3))
+        faces.append((F[np.newaxis] + offsets[:, np.newaxis, np.newaxis])
+                     .reshape(-1, 3))
+        nv += len(Ms) * len(V)
+
+    if not vertices:
+        return Mesh(np.zeros((0, 3)), np.zeros((0, 3), dtype=int))
+
+    return Mesh(np.concatenate(vertices), np.concatenate(faces))
+
+
+#----------------- STL export
+
+#-- Binary STL triangle record (50 bytes)
+STL_DTYPE = np.dtype([("normal", "<f4", (3,)),
+                      ("vertices", "<f4", (3, 3)),
+                      ("attr", "<u2")])
+
+def write_stl(m, fname, header="pyooml"):
+    """Write the m Mesh in the fname binary STL file"""
+
+    data = np.zeros(len(m.faces), dtype=STL_DTYPE)
+    data["normal"] = m.normals()
+    data["vertices"] = m.triangles()
+
+    with open(fname, "wb") as f:
+        f.write(header[:80].ljust(80, "\0"))
+        np.array([len(data)], dtype="<u4").tofile(f)
+        data.tofile(f)
+
+def export_stl(obj, fname):
+    """Write the STL file of a part tree directly, without openscad.
+    Only for unions of primitives: ValueError is raised if the tree
+    has difference or minkowski operators"""
+    write_stl(mesh(obj), fname)
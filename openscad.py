@@ -0,0 +1,186 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- OpenSCAD driver: render the parts into STL, PNG... files
+#-- by calling the openscad program. The results are cached on
+#-- disk, by the hash of the openscad code, the openscad version
+#-- and the render options, so only the parts that have changed
+#-- are rendered again
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from distutils.spawn import find_executable
+
+#-- Default openscad binary. It can be changed with the
+#-- PYOOML_OPENSCAD environment variable
+OPENSCAD = os.environ.get("PYOOML_OPENSCAD", "openscad")
+
+#-- Default directory of the cached renders
+CACHE_DIR = os.environ.get("PYOOML_RENDER_CACHE",
+                           os.path.expanduser("~/.cache/pyooml/render"))
+
+#-- Output of openscad --version, by (binary path, modification time)
+_versions = {}
+
+
+def binary_version(binary):
+    """Return the absolute path of the openscad binary (the links are
+    resolved) and its version. The version is the output of
+    openscad --version (None if it can not be run). It is only asked
+    again when the binary is modified"""
+    path = os.path.realpath(find_executable(binary) or binary)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return path, None
+
+    version = _versions.get((path, mtime))
+    if version is None:
+        try:
+            p = subprocess.Popen([path, "--version"], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+            out, err = p.communicate()
+        except OSError:
+            return path, None
+
+        #-- openscad writes its version on stderr
+        version = _versions[(path, mtime)] = (out + err).strip()
+    return path, version
+
+
+class Renderer(object):
+    """Render parts with openscad, using a pool of subprocesses"""
+
+    def __init__(self, binary=None, cache_dir=None, jobs=None, options=()):
+        """
+        binary: openscad command (default: OPENSCAD)
+        cache_dir: Directory for the cached results (default: CACHE_DIR)
+        jobs: Maximum number of openscad processes (None: one per cpu)
+        options: Extra command line options for openscad. Ex:
+                 ["--imgsize=800,600"]
+        """
+        self.binary = binary or OPENSCAD
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.options = list(options)
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, code, fmt):
+        """Return the cache key of the openscad code rendered into
+        the fmt format with the current binary and options"""
+        h = hashlib.sha1()
+        h.update(code)
+        h.update(repr((binary_version(self.binary), fmt, self.options)))
+        return h.hexdigest()
+
+    def _cached(self, key, fmt):
+        return os.path.join(self.cache_dir, key + "." + fmt)
+
+    def _run(self, code, result):
+        """Call openscad for rendering the code into the result file"""
+
+        fd, scad = tempfile.mkstemp(suffix=".scad", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(code)
+
+            #-- The output is moved to the cache only when finished,
+            #-- so that no partial files are cached
+            fd, tmp = tempfile.mkstemp(suffix=os.path.splitext(result)[1],
+                                       dir=self.cache_dir)
+            os.close(fd)
+            try:
+                cmd = [self.binary, "-o", tmp] + self.options + [scad]
+                p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+                out, err = p.communicate()
+                if p.returncode != 0:
+                    raise RuntimeError("openscad failed ({0}): {1}".format(
+                                       p.returncode, err.strip()))
+                os.rename(tmp, result)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        finally:
+            os.remove(scad)
+
+    def _render(self, task):
+        """Render the code into the cache (if it is not there yet).
+        Executed in the pool threads.
+        It returns the cached file, if it was already cached and the time"""
+        key, code, fmt = task
+
+        t0 = time.time()
+        result = self._cached(key, fmt)
+        cached = os.path.exists(result)
+        if not cached:
+            self._run(code, result)
+        return result, cached, time.time() - t0
+
+    def render(self, obj, fname, modules=False):
+        """Render the obj part into the fname file. The format is
+        given by the extension (stl, png, off, dxf...).
+        It returns True if the cached result was used"""
+        fmt = os.path.splitext(fname)[1][1:]
+        code = obj.scad_gen(modules=modules)
+        result, cached, seconds = self._render((self.key(code, fmt), code, fmt))
+        shutil.copyfile(result, fname)
+        return cached
+
+    def render_all(self, parts, outdir=".", fmt="stl", modules=False):
+        """Render many parts, one file each, in parallel.
+        parts: mapping name -> part, or iterable of (name, part) pairs
+        outdir: output directory (created if it does not exist)
+        fmt: format of the files (stl, png...)
+
+        The parts with the same code are rendered only once.
+        It returns a list of (name, fname, cached, seconds), in the
+        same order than parts"""
+
+        if hasattr(parts, "items"):
+            parts = parts.items()
+
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+        #-- The openscad code is generated here: the threads only wait
+        #-- for the openscad processes. Only one task per cache key
+        outputs, tasks = [], OrderedDict()
+        for name, obj in parts:
+            fname = os.path.join(outdir, "{0}.{1}".format(name, fmt))
+            code = obj.scad_gen(modules=modules)
+            key = self.key(code, fmt)
+            outputs.append((name, fname, key))
+            tasks.setdefault(key, (key, code, fmt))
+
+        pool = ThreadPool(min(self.jobs, max(len(tasks), 1)))
+        try:
+            results = dict(zip(tasks, pool.map(self._render, tasks.values())))
+        finally:
+            pool.close()
+            pool.join()
+
+        report = []
+        for name, fname, key in outputs:
+            result, cached, seconds = results[key]
+            shutil.copyfile(result, fname)
+            report.append((name, fname, cached, seconds))
+        return report
+
+
+def render(obj, fname, modules=False, **kwargs):
+    """Render the obj part into the fname file. The other keyword
+    arguments are the Renderer options. Ex: render(part, "part.stl")"""
+    return Renderer(**kwargs).render(obj, fname, modules=modules)
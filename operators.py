@@ -9,6 +9,8 @@
 #-------------------------------------------------------------
 
 import numpy as np
+import transformations as trans
+import parallel
 from pyooml import *
 
 class operator(part):
@@ -18,15 +20,76 @@ class operator(part):
         #-- Call the parent class constructor
         super(operator, self).__init__(size)
         
-    def scad_gen(self, indent=0):
+    def _iter_body(self, indent=0, modules=None, jobs=None):
         
-        cad = self.cmd + "{\n"
-        childs_cad = [part.scad_gen(indent + 2) for part in self.childs]
-        cad += "".join(childs_cad)
-        cad += " " * indent + "}\n"
-        
-        #-- Call the super-calls scad_gen method
-        return super(operator, self).scad_gen(indent, cad)
+        yield self.cmd + "{\n"
+        if jobs > 1 and len(self.childs) > 1:
+            #-- The code of the childs is generated in parallel
+            for chunk in parallel.iter_childs_scad(self.childs, indent + 2,
+                                                   modules, jobs):
+                yield chunk
+        else:
+            for part in self.childs:
+                for chunk in part.iter_scad(indent + 2, modules):
+                    yield chunk
+        yield " " * indent + "}\n"
+
+    def _collect_modules(self, table):
+        for part in self.childs:
+            part._collect_modules(table)
+
+    def _fingerprint_body(self):
+        for part in self.childs:
+            part._add_parent(self)
+        return self.cmd + "".join(part.fingerprint() for part in self.childs)
+
+    def _iter_leaves(self, M):
+        M = M.dot(self.T)
+        for part in self.childs:
+            #-- The debug parts are only shown: not part of the model
+            if part.debug:
+                continue
+            for leaf in part._iter_leaves(M):
+                yield leaf
+
+    def _solid_childs(self):
+        """Childs that are part of the model (not debug). The object
+        depends on all of them: the debug flag can change"""
+        childs = []
+        for part in self.childs:
+            part._add_parent(self)
+            if not part.debug:
+                childs.append(part)
+        return childs
+
+    def _child_bboxes(self):
+        """Bounding boxes of the childs (the empty and debug ones are
+        not included)"""
+        boxes = []
+        for part in self._solid_childs():
+            box = part.bbox()
+            if box is not None:
+                boxes.append(box)
+        return boxes
+
+    def _local_bbox(self):
+        #-- By default: the bounding box of all the childs
+        boxes = self._child_bboxes()
+        if not boxes:
+            return None
+        return np.array([np.min([b[0] for b in boxes], axis=0),
+                         np.max([b[1] for b in boxes], axis=0)])
+
+    def _dedupe_childs(self, table):
+        childs = [part.dedupe(table) for part in self.childs]
+
+        #-- All the childs were already unique
+        if all(new is old for new, old in zip(childs, self.childs)):
+            return self
+
+        obj = self._clone()
+        obj.childs = childs
+        return obj
 
 
 class difference(operator):
@@ -38,6 +101,16 @@ class difference(operator):
         #-- Call the parent calls constructor first
         super(difference, self).__init__(childs)
 
+    def is_difference(self):
+        return True
+
+    def _local_bbox(self):
+        #-- The result is inside the first object
+        childs = self._solid_childs()
+        if not childs:
+            return None
+        return childs[0].bbox()
+
 
 class minkowski(operator):
     """Minkowski operator"""
@@ -48,6 +121,13 @@ class minkowski(operator):
         #-- Call the parent calls constructor first
         super(minkowski, self).__init__(childs)
 
+    def _local_bbox(self):
+        #-- The minkowski sum of boxes is the sum of their limits
+        boxes = self._child_bboxes()
+        if not boxes:
+            return None
+        return np.sum(boxes, axis=0)
+
 class union(operator):
     """A group of parts"""
     def __init__(self, childs):
@@ -57,27 +137,85 @@ class union(operator):
         #-- Call the parent calls constructor first
         super(union, self).__init__(childs)
 
-    #--- this is for optimization... Not useful at the moment
-    #def __add__(self, other):
-        #-- Optimizacion: if the second argument is an
-        #-- Union too.. incorporate their childs into the
-        #-- union list
-
-        #-- Create list of child objects of the new union
-        #-- (A copy of the current union)
-        #lparts = [p for p in self.lparts]
-
-        #-- If the new object is a union, just added their childs
-        #-- (not the union itself)
-        #if other.is_union():
-            #-- Union + union
-        #    lparts.extend(other.lparts)
-        #else:
-            #-- Union + other part (not union)
-         #   lparts.extend([other])
-
-        #return union(lparts)
-
-    #def is_union(self):
-    #    return True
-    
+    def is_union(self):
+        return True
+
+
+class instances(operator):
+    """The same part placed in N positions. The part is stored only once"""
+    def __init__(self, part, transforms):
+        """
+        part: Object to place
+        transforms: (N,4,4) array of homogeneous matrices or
+                    (N,3) array of translation vectors
+        """
+
+        transforms = np.asarray(transforms, dtype=float)
+
+        if transforms.ndim == 2 and transforms.shape[1] == 3:
+            #-- Translations: build the matrices
+            transforms = trans.Tras_array(transforms)
+        elif transforms.ndim != 3 or transforms.shape[1:] != (4, 4):
+            raise ValueError("transforms should be an (N,4,4) or (N,3) array")
+
+        self.transforms = transforms
+        self.cmd = "instances(n={0})".format(len(transforms))
+
+        #-- Call the parent calls constructor first
+        super(instances, self).__init__([part])
+
+    @property
+    def part(self):
+        return self.childs[0]
+
+    def world_transforms(self):
+        """Return the (N,4,4) matrices of the instances, including
+        the transformation of the whole group"""
+        return np.einsum('ij,njk->nik', self.T, self.transforms)
+
+    def bake(self):
+        """Return the same object, with the group transformation
+        applied to all the instances (in one operation)"""
+        obj = self._clone()
+        obj.transforms = self.world_transforms()
+        obj.T = trans.IDENTITY
+        return obj
+
+    def _iter_leaves(self, M):
+        if self.part.debug:
+            return
+        for Mi in np.einsum('ij,njk->nik', M.dot(self.T), self.transforms):
+            for leaf in self.part._iter_leaves(Mi):
+                yield leaf
+
+    def _local_bbox(self):
+        self.part._add_parent(self)
+        box = None if self.part.debug else self.part.bbox()
+        if box is None:
+            return None
+        return trans.bbox_transform(self.transforms, box)
+
+    def _iter_body(self, indent=0, modules=None, jobs=None):
+
+        #-- The code of the part is only generated once
+        code = list(self.part.iter_scad(indent + 4, modules))
+
+        yield "union(){\n"
+        for M in self.transforms:
+            yield "multmatrix(m={0}) {{\n".format([list(v) for v in M])
+            for chunk in code:
+                yield chunk
+            yield " " * (indent + 2) + "}\n"
+        yield " " * indent + "}\n"
+
+    def _collect_modules(self, table):
+
+        #-- The part is counted once per instance. Only the first
+        #-- time the combinational parts inside are visited
+        for M in self.transforms:
+            self.part._collect_modules(table)
+
+    def _fingerprint_body(self):
+        self.part._add_parent(self)
+        return (self.cmd + self.part.fingerprint() +
+                np.ascontiguousarray(self.transforms).tostring())
@@ -0,0 +1,127 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Parallel generation of the openscad code, and batch export
+#-- of many parts
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import os
+import time
+import multiprocessing
+
+#-- Parts whose code is being generated. The workers are created
+#-- after setting them, so they get them from the parent process
+#-- (fork) instead of receiving them pickled
+_childs = None
+_modules = None
+
+
+def _chunk_scad(task):
+    """Worker: generate the code of a range of childs"""
+    start, end, indent = task
+    return "".join(chunk for part in _childs[start:end]
+                   for chunk in part.iter_scad(indent, _modules))
+
+
+def iter_childs_scad(childs, indent, modules, jobs):
+    """Generate the openscad code of the childs, using a pool of jobs
+    processes. The code is the same (and in the same order) than
+    generating it serially"""
+
+    global _childs, _modules
+
+    #-- Without fork the parts would have to be pickled: serial
+    if not hasattr(os, "fork") or multiprocessing.current_process().daemon:
+        for part in childs:
+            for chunk in part.iter_scad(indent, modules):
+                yield chunk
+        return
+
+    #-- Several chunks per process, so that the load is balanced
+    n = len(childs)
+    nchunks = min(n, jobs * 4)
+    bounds = [n * i // nchunks for i in range(nchunks + 1)]
+    tasks = [(bounds[i], bounds[i + 1], indent) for i in range(nchunks)]
+
+    _childs, _modules = childs, modules
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for code in pool.imap(_chunk_scad, tasks):
+            yield code
+    finally:
+        pool.terminate()
+        _childs = _modules = None
+
+
+#----------------- Batch export
+
+#-- Parts to export: list of (name, part). Also passed by fork
+_exports = None
+
+
+def _export_one(task):
+    """Worker: write the openscad file of one part. It returns the
+    entry of the file in the table of written files, so that the
+    parent process can update its own table"""
+    import pyooml
+
+    i, fname, modules = task
+    part = _exports[i][1]
+
+    t0 = time.time()
+    written = pyooml.write_if_changed(fname, part._iter_code(0, modules))
+    seconds = time.time() - t0
+
+    return i, written, seconds, pyooml._written.get(fname)
+
+
+def export_all(parts, outdir=".", jobs=None, modules=False, ext=".scad"):
+    """Write the openscad code of many parts, one file each, using a
+    pool of processes.
+    parts: mapping name -> part, or iterable of (name, part) pairs
+    outdir: output directory (created if it does not exist)
+    jobs: number of processes (None: one per cpu)
+    modules: Use openscad modules for the repeated parts
+
+    The files whose content has not changed are not rewritten.
+    It returns a list of (name, fname, written, seconds), in the same
+    order than parts"""
+    import pyooml
+
+    global _exports
+
+    if hasattr(parts, "items"):
+        parts = parts.items()
+    parts = list(parts)
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    fnames = [os.path.join(outdir, name + ext) for name, _ in parts]
+    tasks = [(i, fname, modules) for i, fname in enumerate(fnames)]
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(tasks))
+
+    _exports = parts
+    try:
+        if jobs > 1 and hasattr(os, "fork"):
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = list(pool.imap_unordered(_export_one, tasks))
+            finally:
+                pool.terminate()
+        else:
+            results = [_export_one(task) for task in tasks]
+    finally:
+        _exports = None
+
+    report = [None] * len(tasks)
+    for i, written, seconds, entry in results:
+        if entry is not None:
+            pyooml._written[fnames[i]] = entry
+        report[i] = (parts[i][0], fnames[i], written, seconds)
+    return report
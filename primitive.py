@@ -11,61 +11,106 @@ import numpy as np
 from pyooml import *
 
 class primitive(part):
-    """Primitive objects. Simple geometries"""
+    """Primitive objects. Simple geometries.
+    They use __slots__ for a compact representation: there can be
+    thousands of them. The openscad command is calculated from the
+    parameters only when needed"""
+
+    __slots__ = ()
     
-    def scad_gen(self, indent=0):
+    def _iter_body(self, indent=0, modules=None, jobs=None):
         """Create the openscad commands for this object"""
         
-        return super(primitive, self).scad_gen(indent, self.cmd)
+        yield self.cmd
+
+    def _iter_leaves(self, M):
+        yield self, M.dot(self.T)
+
+    def _local_bbox(self):
+        #-- All the primitives are centered in the origin
+        half = np.array(self.size, dtype=float) / 2.
+        return np.array([-half, half])
 
 
 class cube(primitive):
     """Primitive part: A cube"""
+
+    __slots__ = ('size',)
     
     def __init__(self, size):
         
-        #-- Openscad command
-        self.cmd = "cube({},center=true);".format(size)
         self.size = size
         
         #-- Call the parent class constructor first
-        super(cube, self).__init__(size)
+        super(cube, self).__init__(size = None)
+
+    @property
+    def cmd(self):
+        """Openscad command"""
+        return "cube({},center=true);".format(self.size)
 
 
 class cylinder(primitive):
+
+    __slots__ = ('r', 'h', 'res')
+
     def __init__(self, h, r, res=20):
         self.r = r
         self.h = h
-        self.size = [2 * r, 2 * r, h]
-        self.cmd = (
-        "cylinder(r={0}, h={1}, $fn={2},center=true);".format(r, h, res))
+        self.res = res
             
         #-- Call the parent class constructor
-        super(cylinder, self).__init__(size = self.size)
+        super(cylinder, self).__init__(size = None)
+
+    @property
+    def size(self):
+        return [2 * self.r, 2 * self.r, self.h]
+
+    @property
+    def cmd(self):
+        return "cylinder(r={0}, h={1}, $fn={2},center=true);".format(
+               self.r, self.h, self.res)
 
 class cone(primitive):
+
+    __slots__ = ('r1', 'r2', 'h', 'res')
+
     def __init__(self, h, r1, r2, res=20):
         self.r1 = r1
         self.r2 = r2
-        self.r = 0
         self.h = h
-        m = max([r1, r2])
-        self.size = [m, m, h]
-        cmd = "cylinder(r1={0}, r2={1},h={2}, $fn={3}, center=true);"
-        self.cmd = cmd.format(r1, r2, h, res)
+        self.res = res
             
         #-- Call the parent class constructor
-        super(cone, self).__init__(size = self.size)
+        super(cone, self).__init__(size = None)
+
+    @property
+    def size(self):
+        m = max([self.r1, self.r2])
+        return [2 * m, 2 * m, self.h]
+
+    @property
+    def cmd(self):
+        cmd = "cylinder(r1={0}, r2={1},h={2}, $fn={3}, center=true);"
+        return cmd.format(self.r1, self.r2, self.h, self.res)
 
 class sphere(primitive):
     """A sphere"""
+
+    __slots__ = ('r', 'res')
+
     def __init__(self, r, res=40):
 
         self.res = res
         self.r = r
-        self.size = [2 * r, 2 * r, 2 * r]
-        self.cmd = "sphere({0}, $fn={1});".format(self.r, self.res)
     
         #-- Call the parent calls constructor first
-        super(sphere, self).__init__(size = self.size)
+        super(sphere, self).__init__(size = None)
+
+    @property
+    def size(self):
+        return [2 * self.r, 2 * self.r, 2 * self.r]
 
+    @property
+    def cmd(self):
+        return "sphere({0}, $fn={1});".format(self.r, self.res)
@@ -9,21 +9,267 @@
 #-------------------------------------------------------------
 
 import numpy as np
-import utils
-import copy
+import os
+import sys
+import hashlib
+import weakref
+import itertools
+import cache
+from collections import OrderedDict
 import transformations as trans
 
 
+X = 0
+Y = 1
 Z = 2
 
+#-- Cache of the openscad code of the objects, by fingerprint
+#-- Disabled by default: it keeps the code of every subtree in memory
+fragment_cache = cache.LRUCache(maxsize=0)
+
+
+def set_fragment_cache_size(maxsize):
+    """Set the maximum number of openscad fragments stored in the cache.
+    None means no limit. 0 disables the cache"""
+    fragment_cache.resize(maxsize)
+
+#-- Persistent cache of the openscad code of the combinational parts
+#-- (by fingerprint), shared by all the runs and processes.
+#-- Disabled by default (None)
+disk_cache = None
+
+#-- Store the meshes of the parts in the disk cache too
+disk_cache_meshes = False
+
+#-- Default directory of the disk cache
+DISK_CACHE_DIR = os.path.expanduser("~/.cache/pyooml/scad")
+
+
+def set_disk_cache(path=DISK_CACHE_DIR, maxbytes=256 << 20, meshes=False):
+    """Enable the disk cache in the path directory (None: disable it)
+    maxbytes: Maximum size of the cache (None: no limit)
+    meshes: Store the meshes (see mesh.py) too"""
+    global disk_cache, disk_cache_meshes
+
+    disk_cache = None
+    if path is not None:
+        disk_cache = cache.DiskCache(path, maxbytes, code_version())
+    disk_cache_meshes = meshes
+
+
+def code_version():
+    """Version of the code of the library, the part classes and the
+    user modules (the hash of their source files). The disk cache
+    entries of other versions are not used.
+    The user modules are all the modules loaded from the directories
+    of the library, the script and the current directory (not from the
+    python installation): the geometry of the parts can depend on any
+    helper function"""
+    fnames = [trans.__file__]
+    classes = [part]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        fnames.append(_source_file(cls))
+
+    dirs = _project_dirs()
+    system = tuple(os.path.join(os.path.realpath(d), "")
+                   for d in set([sys.prefix, sys.exec_prefix]))
+    for mod in sys.modules.values():
+        fname = getattr(mod, "__file__", None)
+        if not fname:
+            continue
+        path = _real_sources.get(fname)
+        if path is None:
+            path = _real_sources[fname] = os.path.realpath(
+                os.path.splitext(fname)[0] + ".py")
+        if path.startswith(dirs) and not path.startswith(system):
+            fnames.append(path)
+
+    return cache.source_version([fname for fname in fnames if fname])
+
+
+#-- Real paths of the source files of the modules, by module file name
+_real_sources = {}
+
+
+def _project_dirs():
+    """Directories of the library, the script and the current directory"""
+    dirs = [os.path.dirname(__file__), os.getcwd()]
+    if sys.argv and sys.argv[0]:
+        dirs.append(os.path.dirname(sys.argv[0]))
+    return tuple(os.path.join(os.path.realpath(d), "") for d in dirs)
+
+
+def _source_file(obj):
+    """Source file of the module of a class or function (or None)"""
+    fname = getattr(sys.modules.get(obj.__module__), "__file__", None)
+    return fname and os.path.splitext(fname)[0] + ".py"
+
+
+def object_version(obj):
+    """Version of the code of a class (and its parents) or function:
+    the hash of their source files. It is calculated only once per
+    object: the classes of the reloaded modules are new objects, with
+    a new version"""
+    try:
+        return obj.__dict__["_version_cache"]
+    except KeyError:
+        objs = obj.__mro__ if isinstance(obj, type) else [obj]
+        version = cache.source_version([fname for fname in map(_source_file, objs)
+                                        if fname])
+        setattr(obj, "_version_cache", version)
+        return version
+
+
+def _slot_names(cls):
+    """Return all the slots of the cls class (and its parents)"""
+    try:
+        return cls.__dict__["_slot_names_cache"]
+    except KeyError:
+        names = [name for c in cls.__mro__
+                 for name in c.__dict__.get("__slots__", ())
+                 if name not in ("__dict__", "__weakref__")]
+        setattr(cls, "_slot_names_cache", names)
+        return names
+
+
+class _frozen_list(list):
+    """List that can not be modified in place: the sizes of the parts
+    (shared by the clones). Its str is the one of a list (openscad code)"""
+
+    def _read_only(self, *args):
+        raise TypeError("the list is read only: assign a new one")
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = append = extend = insert = _read_only
+    pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (_frozen_list, (list(self),))
+
+
+def _readonly(a):
+    """Make the new a array read only and return it"""
+    a.flags.writeable = False
+    return a
+
+
+def _readonly_copy(a):
+    """Read only version of the a array (a copy if it is writeable)"""
+    if isinstance(a, np.ndarray) and a.flags.writeable:
+        a = _readonly(a.copy())
+    return a
+
+
+def _frozen_vector(v):
+    """Read only version of a list or array (sizes and colors)"""
+    if isinstance(v, list) and not isinstance(v, _frozen_list):
+        return _frozen_list(v)
+    return _readonly_copy(v)
+
+
+class _chained_childs(object):
+    """Read only sequence of the first n parts of a list. The list is
+    shared by the operators of a chain a + b + c + ...: the last
+    operator of the chain appends the new parts to it (without copying
+    the previous ones), so building the chain is linear"""
+
+    __slots__ = ('_items', '_n')
+
+    def __init__(self, items, n):
+        self._items = items
+        self._n = n
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._n)
+
+    def __reversed__(self):
+        return reversed(self._items[:self._n])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self._items[:self._n][i])
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("childs index out of range")
+        return self._items[i]
+
+    def __reduce__(self):
+        return (tuple, (tuple(self),))
+
+    def extended(self, parts):
+        """Return the sequence with the parts added at the end"""
+        items = self._items
+        if len(items) != self._n:
+            #-- Another operator has already been chained: copy
+            items = items[:self._n]
+        items.extend(parts)
+        return _chained_childs(items, len(items))
+
+
+def _chain(childs, parts):
+    """Childs of a new operator: the childs followed by the parts"""
+    if isinstance(childs, _chained_childs):
+        return childs.extended(parts)
+    items = list(childs)
+    items.extend(parts)
+    return _chained_childs(items, len(items))
+
+
+def _frozen_childs(childs):
+    if isinstance(childs, (tuple, _chained_childs)):
+        return childs
+    return tuple(childs)
+
+
+#-- The attributes that are shared by the clones (copy-on-write) can not be
+#-- modified in place: the changes would not be detected by the dirty
+#-- tracking. They are converted into read only objects when assigned
+_FREEZE = {"T": _readonly_copy, "transforms": _readonly_copy,
+           "size": _frozen_vector, "col_rgb": _frozen_vector,
+           "childs": _frozen_childs}
+
+#-- Default color: [2,2,2] (shared by all the objects: read only)
+DEFAULT_RGB = _frozen_list([2, 2, 2])
+
+
 class part(object):
     """Class for defining an object. This class is virtual"""
 
+    #-- The subclasses that define __slots__ too (like the primitives)
+    #-- have no __dict__
+    __slots__ = ('T', 'col', 'col_rgb', 'alpha', 'debug', 'show_frame',
+                 '_cached', '_fp', '_bbox', '_parents', '__weakref__')
+
+    #-- Slots with cached data: fingerprint and bounding box
+    _caches = ('_fp', '_bbox')
+
+    #-- The code of these parts is stored in the disk cache
+    _persistent = False
+
+    def __new__(cls, *args, **kwargs):
+        obj = object.__new__(cls)
+
+        #-- Cached data (fingerprint, bounding box...)
+        obj._invalidate()
+
+        #-- Objects whose cached data depends on this one
+        #-- (weak references, by object id)
+        object.__setattr__(obj, "_parents", None)
+        return obj
+
     def __init__(self, size=[0, 0, 0]):
         
         #-- Object transformation matrix
         #-- It defines its position and orientation
-        self.T = trans.Identity()
+        #-- All the objects share the same (read only) identity
+        #-- matrix until they are transformed
+        self.T = trans.IDENTITY
 
         #-- Set the default color parameters, it they had not been
         #-- already set by the subclases
@@ -38,7 +284,7 @@ class part(object):
         except AttributeError: 
             #-- Only if an empty string, the col_rgb
             #-- will be used (the str format has priority over rgb)
-            self.col_rgb = [2, 2, 2]  #--- [2,2,2] means default color
+            self.col_rgb = DEFAULT_RGB  #--- [2,2,2] means default color
         
         try:
             self.alpha
@@ -50,22 +296,260 @@ class part(object):
         self.show_frame = False
         
         #-- Object size (bounding box)
-        self.size = size
+        #-- None: it is calculated by the subclass
+        if size is not None:
+            self.size = size
 
     def id(self):
         return  "//-- {}".format(self.cmd)
 
+    def __setattr__(self, name, value):
+        freeze = _FREEZE.get(name)
+        if freeze is not None:
+            value = freeze(value)
+        object.__setattr__(self, name, value)
+
+        #-- Dirty tracking: changing a public attribute (matrix, color,
+        #-- flags, parameters...) invalidates the cached data
+        #-- (if something has been cached, or depends on the object)
+        if (self._cached or self._parents) and name[0] != "_":
+            self._touch()
+
+    def _touch(self):
+        """The object has been modified. Invalidate its cached data and
+        the data of all the objects that depend on it"""
+
+        pending = [self]
+        while pending:
+            obj = pending.pop()
+            obj._invalidate()
+
+            #-- The parents will register again when they recalculate
+            parents = obj._parents
+            object.__setattr__(obj, "_parents", None)
+            if parents:
+                pending.extend(p for p in (ref() for ref in parents.itervalues())
+                               if p is not None)
+
+    def _invalidate(self):
+        """Remove the cached data of the object"""
+        for name in self._caches:
+            object.__setattr__(self, name, None)
+        object.__setattr__(self, "_cached", False)
+
+    def _cache(self, name, value):
+        """Store cached data of the object"""
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "_cached", True)
+
+    def _add_parent(self, parent):
+        """Register the parent object: its cached data depends on this one"""
+        parents = self._parents
+        if parents is None:
+            parents = {}
+            object.__setattr__(self, "_parents", parents)
+        else:
+            ref = parents.get(id(parent))
+            if ref is not None and ref() is parent:
+                return
+
+        #-- A dead reference with the same id is replaced
+        parents[id(parent)] = weakref.ref(parent)
+
+    def _clone(self):
+        """Return a shallow copy of the object. The children, parameters
+        and matrices are shared with the original (copy-on-write): the
+        transformations always assign a NEW matrix to the clone, so
+        the cost does not depend on the size of the subtree"""
+        cls = self.__class__
+
+        #-- Not cls.__new__: in lazy mode it returns a deferred node
+        obj = part.__new__(cls)
+        for name in _slot_names(cls):
+            try:
+                object.__setattr__(obj, name, getattr(self, name))
+            except AttributeError:
+                pass
+        if hasattr(self, "__dict__"):
+            obj.__dict__.update(self.__dict__)
+
+        #-- The cached data is not shared
+        obj._invalidate()
+        object.__setattr__(obj, "_parents", None)
+        return obj
+
+    def __getstate__(self):
+        """Pickle support. The cached data is not saved"""
+        state = dict((name, getattr(self, name)) for name in _slot_names(self.__class__)
+                     if hasattr(self, name))
+        if hasattr(self, "__dict__"):
+            state.update(self.__dict__)
+        for name in self._caches:
+            state[name] = None
+        state["_cached"] = False
+        state["_parents"] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def fingerprint(self):
+        """Return the content hash of the object: its class (and the
+        version of its code), openscad command, matrix, color, flags and
+        childs. Objects with the same fingerprint generate the same
+        openscad code. It is calculated only once, from the childs
+        fingerprints"""
+
+        if self._fp is None:
+            cls = self.__class__
+            h = hashlib.sha1()
+            h.update(cls.__module__ + "." + cls.__name__)
+            h.update(object_version(cls))
+            h.update(self._fingerprint_body())
+            h.update(np.ascontiguousarray(self.T, dtype=float).tostring())
+            h.update(repr((self.col, list(self.col_rgb), self.alpha,
+                           self.debug, self.show_frame)))
+            self._cache("_fp", h.hexdigest())
+
+        return self._fp
+
+    def _fingerprint_body(self):
+        """String that identifies the object itself (without
+        its transformation and color)"""
+        return self.cmd
+
+    def dedupe(self, table=None):
+        """Return the same tree of objects, but with the identical
+        subtrees shared (only one object for every fingerprint)
+        table: dictionary of the unique objects {fingerprint: object}"""
+
+        if table is None:
+            table = {}
+
+        obj = self._dedupe_childs(table)
+        return table.setdefault(obj.fingerprint(), obj)
+
+    def _dedupe_childs(self, table):
+        """Return the object with its childs deduplicated"""
+        return self
+
+    def bbox(self):
+        """Return the axis aligned bounding box of the object, in the
+        coordinates of its parent (the object matrix is applied):
+        [[xmin, ymin, zmin], [xmax, ymax, zmax]]
+        None if the object is empty. The debug subtrees are not included
+        (as in leaves()). It is only calculated once"""
+
+        if self._bbox is None:
+            box = self._local_bbox()
+            if box is None:
+                return None
+            box = trans.bbox_transform(self.T, box)
+            box.flags.writeable = False
+            self._cache("_bbox", box)
+
+        return self._bbox
+
+    def _local_bbox(self):
+        """Bounding box of the object without its transformation.
+        Virtual: defined in the subclasses"""
+        return None
+
+    def leaves(self):
+        """Return the list of the primitives of the tree, with their
+        accumulated matrices: [(primitive, M), ...]
+        The debug subtrees (background parts in openscad) are not
+        included. The debug flag of the object itself is ignored"""
+        return list(self._iter_leaves(trans.IDENTITY))
+
+    def _iter_leaves(self, M):
+        """Generate the primitives of the tree. M is the matrix of the
+        parent. Virtual: defined in the subclasses"""
+        return iter([])
+
+    def mesh(self):
+        """Return the triangle mesh of the object, calculated without
+        openscad (see the mesh module). Only for unions of primitives"""
+        import mesh
+        return mesh.mesh(self)
+
+    def export_stl(self, fname):
+        """Write the binary STL file of the object, without openscad.
+        Only for unions of primitives (no difference or minkowski)"""
+        import mesh
+        mesh.export_stl(self, fname)
+
+    def save(self, fname):
+        """Save the object in a binary scene file (see the scene
+        module). It is loaded with scene.load(fname)"""
+        import scene
+        scene.save(self, fname)
+
+    def overlaps(self, other):
+        """Return True if the bounding boxes of both objects overlap"""
+        a, b = self.bbox(), other.bbox()
+        if a is None or b is None:
+            return False
+        return bool((a[0] <= b[1]).all() and (b[0] <= a[1]).all())
+
+    #--------- Anchors: points of the bounding box
+    @property
+    def center(self):
+        """Center of the bounding box"""
+        box = self.bbox()
+        return (box[0] + box[1]) / 2.
+
+    def _anchor(self, axis, side):
+        """Center of a face of the bounding box
+        axis: X, Y or Z. side: 0 (min) or 1 (max)"""
+        p = self.center
+        p[axis] = self.bbox()[side][axis]
+        return p
+
+    @property
+    def top(self):
+        """Center of the top face (z max)"""
+        return self._anchor(Z, 1)
+
+    @property
+    def bottom(self):
+        """Center of the bottom face (z min)"""
+        return self._anchor(Z, 0)
+
+    @property
+    def right(self):
+        """Center of the right face (x max)"""
+        return self._anchor(X, 1)
+
+    @property
+    def left(self):
+        """Center of the left face (x min)"""
+        return self._anchor(X, 0)
+
+    @property
+    def back(self):
+        """Center of the back face (y max)"""
+        return self._anchor(Y, 1)
+
+    @property
+    def front(self):
+        """Center of the front face (y min)"""
+        return self._anchor(Y, 0)
+
     def Tras(self, vt):
         """Translate function. It returns the same object
         but translated a vetor vt (ABSOLUTE TRANSLATION)"""
         
         #-- Make a copy of the object
-        obj = copy.deepcopy(self)
+        obj = self._clone()
         
         #-- Calculate the new transformation matrix
-        obj.T[0,3] += vt[0]
-        obj.T[1,3] += vt[1]
-        obj.T[2,3] += vt[2]
+        T = self.T.copy()
+        T[0,3] += vt[0]
+        T[1,3] += vt[1]
+        T[2,3] += vt[2]
+        obj.T = _readonly(T)
         
         #-- Return the NEW object
         return obj    
@@ -76,47 +560,20 @@ class part(object):
         (ABSOLUTE ROTATION)"""
         
         #-- Make a copy of the object
-        obj = copy.deepcopy(self)
+        obj = self._clone()
 
         #-- Calculate the new transformation matrix
-        obj.T = trans.Rot(a,v).dot(self.T)
+        obj.T = _readonly(trans.rotation(a,v).dot(self.T))
         
         #-- Return the NEW object
         return obj
         
     def Orien(self, v, vref=[0., 0., 1.], roll = 0.):
-        
-        #-- Calculate the rotating axis: raxis = vref x v
-        raxis = list(np.cross(vref, v))
-
-        #-- Calculate the angle to rotate vref around rxis
-        #-- so that vref = v
-        ang = utils.anglev(vref, v)
-        
-        #-- Special case.. If ang is 0 is because vref and v are paralell
-        #-- Only the roll angle have to be applied
-        #-- Give raxis a random value (it should be != [0,0,0]
-        if ang == 0.0:
-            raxis = [0,0,1]
-        
-        #--Special case... If the rotation angle is 180...
-        #-- we should calculate a new rotation axis (because
-        #-- it will be 0,0,0, and it is not valid)
-        if ang == 180.0:
-            a,b,c = vref
-            if a != 0.:
-                raxis = [-b/a, 1., 0.]
-            elif b != 0.:
-                raxis = [1., -a/b, 0.]
-            elif c != 0.:
-                raxis = [0., 1., -b/c]
-            else:
-                print "Error! Vref=(0,0,0)"
-        
-        #-- Create a new object with the given orientation
-        obj = self.Rot(ang, raxis).Rot(roll,v)
-        
-        return obj
+        """Orientation function. It returns the same object but
+        rotated so that the vref vector points in the v direction, and
+        then rotated an angle roll around v (ABSOLUTE ROTATION)"""
+
+        return self.transform().orien(v, vref, roll).apply()
 
     #def Move(self, pt, ot = [0., 0., 1.], ps = [0., 0., 0.], os = [0., 0., 1.], ang = 0.):
     def Move(self, cs, ct):
@@ -131,15 +588,22 @@ class part(object):
         ang = ct.ang - cs.ang
         
         #-- Fist, translate the objet to the origin
-        obj = self.Tras(-ps)
-        
-        #--- Set the new object orientation
-        obj = obj.Orien(v=ot, vref = os, roll = ang)
-        
-        #-- Translate the object to the target position
-        obj = obj.Tras(pt)
+        #--- Then set the new object orientation
+        #-- and translate the object to the target position
+        #-- Only one new object is created
+        obj = (self.transform()
+               .tras(-ps)
+               .orien(v=ot, vref = os, roll = ang)
+               .tras(pt)
+               .apply())
         
         return obj
+
+    def transform(self):
+        """Start a chain of transformations on the object. The
+        transformations are accumulated in a single matrix and they
+        are only applied when calling apply()"""
+        return transform(self)
         
     def color(self, c, alpha = 1.0):
         """Create a copy of the object in a different color"""
@@ -153,11 +617,12 @@ class part(object):
             col = ""
             
         #-- Make a copy of the object
-        obj = copy.deepcopy(self)
+        obj = self._clone()
         
         #-- Change the color
         obj.col = col
-        obj.c = c
+        if col == "":
+            obj.col_rgb = c
         obj.alpha = alpha
         
         #-- Return the new object
@@ -165,37 +630,110 @@ class part(object):
 
     # overload +
     def __add__(self, other):
-        return union([self, other])
+
+        #-- Optimization: the childs of the unions without their
+        #-- own transformation or color are incorporated into the
+        #-- new union, instead of the unions themselves. So
+        #-- a + b + c + d is one union of 4 parts, not a nested tree
+        #-- The childs are shared with self (see _chained_childs)
+        if self.is_union() and self._is_bare():
+            lparts = self.childs
+        else:
+            lparts = [self]
+
+        if other.is_union() and other._is_bare():
+            return union(_chain(lparts, other.childs))
+        return union(_chain(lparts, [other]))
 
     #-- Overload - operator
     def __sub__(self, other):
-        return difference([self, other])
+
+        #-- Optimization: a - b - c is one difference of 3 parts.
+        #-- Subtracting a union is the same than subtracting all
+        #-- its childs
+        if self.is_difference() and self._is_bare():
+            lparts = self.childs
+        else:
+            lparts = [self]
+
+        if other.is_union() and other._is_bare():
+            return difference(_chain(lparts, other.childs))
+        return difference(_chain(lparts, [other]))
+
+    def _is_bare(self):
+        """Return True if the object has no transformation, color or
+        display flags of its own, so it can be merged into its parent"""
+        return (not self.debug and not self.show_frame and
+                self.col == "" and self.col_rgb == [2, 2, 2] and
+                (self.T is trans.IDENTITY or
+                 (self.T == trans.IDENTITY).all()))
     
-    def scad_gen(self, indent=0, cmd=""):
-        
-        #-- Initial string
-        cad = " " * indent
-        
+    def iter_scad(self, indent=0, modules=None, jobs=None):
+        """Generate the openscad code of the object, chunk by chunk.
+        The tree is traversed depth-first, so the code is never fully
+        built in memory.
+        modules: table of the parts emitted as openscad modules
+        (see scad_modules())
+        jobs: number of processes for generating the code of the
+        childs of the top operator (None: serial)"""
+
+        if jobs > 1:
+            return self._iter_scad(indent, modules, jobs)
+
+        #-- Fragment cache enabled: the code of the subtrees that have
+        #-- not changed is reused
+        if modules is None and fragment_cache.maxsize != 0:
+            key = (self.fingerprint(), indent)
+            code = fragment_cache.get(key)
+            if code is None:
+                code = self._stored_scad(indent, self._persistent)
+                fragment_cache.put(key, code)
+            return iter((code,))
+
+        if modules is None and self._persistent and disk_cache is not None:
+            return iter((self._stored_scad(indent, True),))
+
+        return self._iter_scad(indent, modules)
+
+    def _stored_scad(self, indent, persistent):
+        """Return the openscad code of the object. If persistent, it is
+        taken from the disk cache (if enabled)"""
+
+        if not persistent or disk_cache is None:
+            return "".join(self._iter_scad(indent))
+
+        key = "scad-{0}-{1}".format(self.fingerprint(), indent)
+        code = disk_cache.get(key)
+        if code is None:
+            code = "".join(self._iter_scad(indent))
+            disk_cache.put(key, code)
+        return code
+
+    def _iter_scad(self, indent=0, modules=None, jobs=None):
+        """Generate the openscad code of the object (no cache)"""
         
         #-- Get the object matrix as a list
         T = [list(v) for v in self.T]
         
-        cad = self.id()+'\n'
-        cad += "multmatrix(m={0}) {{".format(T) 
+        yield self.id()+'\n'
+        yield "multmatrix(m={0}) {{".format(T) 
         
         #-- Add the Frame of reference
         if self.show_frame:
-          cad += frame().scad_gen() 
+          for chunk in frame().iter_scad():
+              yield chunk
         
         #-- Add the debug mode
         if self.debug:
-            cad += '%'
+            yield '%'
 
             
         #----- Color managment
         if self.col == "" and self.col_rgb == [2, 2, 2]:
             #-- No color
-            cad += cmd + '\n'
+            for chunk in self._iter_body(indent, modules, jobs):
+                yield chunk
+            yield '\n'
             
         else:
             #-- Color given..
@@ -209,9 +747,12 @@ class part(object):
             #-- Calculate the final color argument
             color_cmd = 'color({0},{1})'.format(color_arg, self.alpha)
             
-            cad += color_cmd + '{\n' + cmd + '\n}\n'
+            yield color_cmd + '{\n'
+            for chunk in self._iter_body(indent, modules, jobs):
+                yield chunk
+            yield '\n}\n'
 
-        cad += "}\n"  #-- Close the multimatrix bracket
+        yield "}\n"  #-- Close the multimatrix bracket
         
         #-- Attached parts
         #for ap in self.conn_childs:
@@ -221,27 +762,195 @@ class part(object):
         #for conn in self.lconns:
         #    p,o = conn  #-- Get the position and orientation vectors
         #    cad += connector(p,o).scad_gen(indent+2)
-        
-        return cad
 
-    #-- This method is used for optimizacion
+    def _iter_body(self, indent=0, modules=None, jobs=None):
+        """Generate the openscad code of the object itself (without
+        its transformation and color). Virtual: defined in the subclasses"""
+        return iter([])
+
+    def _collect_modules(self, table):
+        """Count the combinational parts of the tree in the table.
+        Virtual: defined in the subclasses"""
+        pass
+
+    def scad_modules(self):
+        """Return the table of the combinational parts that appear more
+        than once in the tree: {key: (module name, geometry)}"""
+
+        table = OrderedDict()
+        self._collect_modules(table)
+
+        modules = OrderedDict()
+        for key, (count, geo, name) in table.items():
+            if count > 1:
+                modules[key] = (name, geo)
+
+        return modules
+
+    def iter_scad_modules(self, indent=0, jobs=None):
+        """Generate the openscad code of the object. The parts that
+        are repeated are defined only once, as openscad modules, and
+        then they are called from every instance"""
+
+        modules = self.scad_modules()
+
+        #-- Modules definitions
+        for name, geo in modules.values():
+            yield "module {0}() {{\n".format(name)
+            for chunk in geo.iter_scad(0, modules):
+                yield chunk
+            yield "}\n"
+
+        for chunk in self.iter_scad(indent, modules, jobs):
+            yield chunk
+
+    def scad_gen(self, indent=0, modules=False, jobs=None):
+        """Return the openscad code of the object as a string.
+        modules: Use openscad modules for the repeated parts
+        jobs: Number of processes (None: serial)"""
+        return "".join(self._iter_code(indent, modules, jobs))
+
+    def write_scad(self, fp, indent=0, modules=False, jobs=None):
+        """Write the openscad code of the object into the file object fp
+        modules: Use openscad modules for the repeated parts
+        jobs: Number of processes (None: serial)"""
+        fp.writelines(self._iter_code(indent, modules, jobs))
+
+    def _iter_code(self, indent, modules, jobs=None):
+        if disk_cache is not None:
+            #-- The part classes could have been modified (watcher)
+            disk_cache.version = code_version()
+
+        if modules:
+            return self.iter_scad_modules(indent, jobs)
+
+        #-- The code of the whole design is streamed, never joined: only
+        #-- the code of the subtrees is cached (by fingerprint)
+        return self._iter_scad(indent, jobs=jobs)
+
+    #-- These methods are used for optimizacion
     def is_union(self):
         return False
 
-    def render(self, indent=0):
-        print self.scad_gen(indent)
+    def is_difference(self):
+        return False
+
+    def render(self, indent=0, modules=False, jobs=None):
+        self.write_scad(sys.stdout, indent, modules, jobs)
+        sys.stdout.write('\n')
+
+    def show(self, modules=False, fname="test.scad", jobs=None):
+        """Write the openscad code into the fname file. The file is
+        only rewritten if its content changes
+        jobs: Number of processes for generating the code (None: serial)"""
+        write_if_changed(fname, self._iter_code(0, modules, jobs))
+
 
-    def show(self):
-        f = open("test.scad", "w")
+#-- Hash of the files written by write_if_changed:
+#-- {file name: (digest, mtime, size)}
+_written = {}
 
-        code = self.scad_gen()
+def _file_digest(fname):
+    """Return the hash of the file content (None if it does not exist)"""
 
-        f.write(code)
+    #-- The file was written by us and it has not been modified
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
 
-        f.close()
+    digest, mtime, size = _written.get(fname, (None, None, None))
+    if (mtime, size) == (st.st_mtime, st.st_size):
+        return digest
+
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def write_if_changed(fname, chunks):
+    """Write the chunks of text into the fname file, but only if the
+    new content is different. The chunks are streamed to a temporal
+    file while calculating their hash. It returns True if the file
+    was written"""
+
+    tmp = "{0}.{1}.tmp".format(fname, os.getpid())
+    h = hashlib.sha1()
+    try:
+        with open(tmp, "w", 1 << 16) as f:
+            for chunk in chunks:
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        #-- Ex. an error in the geometry of a part (the chunks are
+        #-- generated while writing)
+        os.remove(tmp)
+        raise
+    digest = h.hexdigest()
+
+    if digest == _file_digest(fname):
+        os.remove(tmp)
+        return False
+
+    os.rename(tmp, fname)
+    st = os.stat(fname)
+    _written[fname] = (digest, st.st_mtime, st.st_size)
+    return True
+
+
+class transform(object):
+    """Lazy transformation builder. It accumulates a chain of
+    transformations (ABSOLUTE, applied in the calling order) into
+    one homogeneous matrix. Ex:
+
+      obj.transform().tras([10, 0, 0]).rot(90, [0, 0, 1]).apply()
+
+    returns the same object as obj.Tras([10, 0, 0]).Rot(90, [0, 0, 1])
+    but only one new object is created
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+        #-- Accumulated matrix
+        self.M = trans.Identity()
+
+    def _push(self, M):
+        """Apply the matrix M after the current ones"""
+        self.M = M.dot(self.M)
+        return self
+
+    def tras(self, vt):
+        """Translate a vector vt"""
+        return self._push(trans.Tras(vt))
+
+    def rot(self, a, v):
+        """Rotate an angle a around the axis given by v"""
+        return self._push(trans.rotation(a, v))
+
+    def orien(self, v, vref=[0., 0., 1.], roll=0.):
+        """Orientate the vref vector in the v direction and roll
+        an angle roll around it"""
+        return self._push(trans.Orien(v, vref, roll))
+
+    def apply(self):
+        """Return the NEW object with all the transformations applied"""
+        obj = self.obj._clone()
+        obj.T = _readonly(self.M.dot(self.obj.T))
+        return obj
 
 
 from primitive import *
 from combinational import *
 from operators import *
 
+
+#-- Optional disk cache
+if os.environ.get("PYOOML_CACHE_DIR"):
+    set_disk_cache(os.environ["PYOOML_CACHE_DIR"])
+
+#-- Optional instrumentation (see instrument.py)
+if os.environ.get("PYOOML_PROFILE"):
+    import instrument
+    instrument.enable_from_env()
@@ -0,0 +1,561 @@
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Binary scene files: save the part trees already built and
+#-- load them without running the script that builds them.
+#--
+#-- File format (little endian):
+#--   magic "PYOOML\0\1", header length (uint64), header (json),
+#--   and the arrays, aligned to 8 bytes:
+#--     nodes:    table of nodes (NODE_DTYPE). The childs (and the
+#--               parts used as parameters) are always before their
+#--               parents. The last one is the root
+#--     childs:   node indexes of the childs of the operators
+#--     matrices: (M,4,4) float64. The matrices of all the nodes and
+#--               the transforms of the instances
+#--     numbers:  float64. The numeric parameters of the primitives
+#--     strings:  the strings (colors and json parameters) one after
+#--               the other, and their offsets
+#--
+#-- The header has the format version, the class names of the nodes
+#-- and the layouts of the numeric parameters: for every class and
+#-- types of parameters, the list of [name, is_list, kinds], where
+#-- kinds has one letter per number (f: float, i: int, b: bool).
+#--
+#-- The other parameters are stored in json: no code is executed
+#-- when loading (only the modules of the part classes and factories
+#-- are imported). The shared subtrees are stored only once. When
+#-- loading, the file is memory-mapped and the matrices are views of it
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
+
+import os
+import sys
+import json
+import gc
+import types
+import struct
+import tempfile
+import itertools
+import importlib
+from contextlib import contextmanager
+import numpy as np
+import transformations as trans
+import pyooml
+from pyooml import *
+
+MAGIC = "PYOOML\0\1"
+
+#-- Version of the format
+VERSION = 2
+
+#-- Node table
+NODE_DTYPE = np.dtype([("cls", "<i4"),      #-- Class (index in the header)
+                       ("layout", "<i4"),   #-- Parameters layout (-1: json)
+                       ("params", "<i4"),   #-- First number or json string
+                       ("T", "<i4"),        #-- Matrix (-1: identity)
+                       ("col", "<i4"),      #-- Color name (string)
+                       ("rgb", "<i4"),      #-- RGB color (json string)
+                       ("alpha", "<f8"),
+                       ("flags", "u1"),     #-- 1: debug, 2: show_frame
+                       ("child0", "<i4"),   #-- First child
+                       ("nchilds", "<i4"),
+                       ("mat0", "<i4"),     #-- First matrix of the instances
+                       ("nmats", "<i4")])
+
+#-- Types of the arrays of the file
+ARRAY_DTYPES = {"nodes": NODE_DTYPE, "childs": np.dtype("<i4"),
+                "matrices": np.dtype("<f8"), "numbers": np.dtype("<f8"),
+                "offsets": np.dtype("<i8"), "strings": np.dtype("u1")}
+
+#-- Attributes that are stored in the node table (not in the parameters)
+_NODE_ATTRS = set(part.__slots__) | set(["childs", "transforms"])
+
+#-- Kinds of the numeric parameters
+_KINDS = {float: "f", int: "i", long: "i", bool: "b"}
+_CONVERT = {"f": float, "i": int, "b": bool}
+
+
+def _kind(value):
+    """Kind of a number (None if it is not a number)"""
+    kind = _KINDS.get(type(value))
+    if kind is None:
+        if isinstance(value, np.floating):
+            return "f"
+        if isinstance(value, np.integer):
+            return "i"
+    return kind
+
+
+def _parts_in(value):
+    """Generate the parts inside a parameter value"""
+    if isinstance(value, part):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            for p in _parts_in(v):
+                yield p
+    elif isinstance(value, dict):
+        for item in value.items():
+            for p in _parts_in(item):
+                yield p
+
+
+@contextmanager
+def _no_gc():
+    """The collector is not run while the nodes are created: the
+    objects are never garbage and it scans them again and again"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _Writer(object):
+
+    def __init__(self):
+        self.nodes = []
+        self.childs = []
+        self.matrices = []
+        self.numbers = []
+        self.strings = []
+        self.string_index = {}
+        self.classes = []
+        self.class_index = {}
+        self.layouts = []
+        self.layout_index = {}
+
+        #-- Index of the nodes already written, by object id
+        self.written = {}
+
+        #-- Parameters of the primitives (by class and repr), the
+        #-- colors (by list id)
+        self.params_index = {}
+        self.rgb_index = {}
+
+    def string(self, s):
+        i = self.string_index.get(s)
+        if i is None:
+            i = self.string_index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def class_info(self, obj):
+        """Return (index, is operator, is instances, has no __dict__,
+        parameter slots) of the class of obj"""
+        cls = obj.__class__
+        info = self.class_index.get(cls)
+        if info is None:
+            names = [name for name in pyooml._slot_names(cls)
+                     if name not in _NODE_ATTRS]
+            info = self.class_index[cls] = (
+                len(self.classes), issubclass(cls, operator),
+                issubclass(cls, instances), not hasattr(obj, "__dict__"),
+                names)
+            self.classes.append(cls.__module__ + "." + cls.__name__)
+        return info
+
+    def params(self, obj, info):
+        """Return the (layout, params) of the object parameters"""
+
+        #-- Primitives: the numbers (and lists of numbers) in the slots.
+        #-- The same parameters are only stored once (the repr
+        #-- distinguishes the ints and floats)
+        if info[3]:
+            values = [getattr(obj, name, None) for name in info[4]]
+            key = (info[0], repr(values))
+            typed = self.params_index.get(key)
+            if typed is None:
+                typed = self.numbers_params(info, values)
+                if typed is not None:
+                    self.params_index[key] = typed
+            if typed is not None:
+                return typed
+
+        return -1, self.json_params(obj, info)
+
+    def numbers_params(self, info, values):
+        fields, numbers = [], []
+        for name, value in zip(info[4], values):
+            kind = _kind(value)
+            if kind is not None:
+                fields.append((name, 0, kind))
+                numbers.append(value)
+            elif isinstance(value, list):
+                kinds = "".join([_kind(v) or "?" for v in value])
+                if "?" in kinds:
+                    return None
+                fields.append((name, 1, kinds))
+                numbers.extend(value)
+            else:
+                return None
+
+        key = (info[0], tuple(fields))
+        layout = self.layout_index.get(key)
+        if layout is None:
+            layout = self.layout_index[key] = len(self.layouts)
+            self.layouts.append([info[0], [list(field) for field in fields]])
+
+        i = len(self.numbers)
+        self.numbers.extend(numbers)
+        return layout, i
+
+    def json_params(self, obj, info):
+        state = [(name, getattr(obj, name)) for name in info[4]
+                 if hasattr(obj, name)]
+        if hasattr(obj, "__dict__"):
+            state += [(name, value) for name, value in obj.__dict__.items()
+                      if name[0] != "_" and name not in _NODE_ATTRS]
+        state.sort(key=lambda item: item[0])
+        return self.string(json.dumps([[name, self.encode(value)]
+                                       for name, value in state]))
+
+    def encode(self, value):
+        """json version of a parameter value. The tuples, dicts, arrays,
+        parts and classes or functions are tagged"""
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is None or isinstance(value, (bool, int, long, float,
+                                               basestring)):
+            return value
+        if isinstance(value, part):
+            return {"$node": self.written[id(value)]}
+        if isinstance(value, list):
+            return [self.encode(v) for v in value]
+        if isinstance(value, tuple):
+            return {"$tuple": [self.encode(v) for v in value]}
+        if isinstance(value, dict):
+            return {"$dict": [[self.encode(k), self.encode(v)]
+                              for k, v in value.items()]}
+        if isinstance(value, np.ndarray):
+            return {"$array": value.tolist(), "dtype": value.dtype.str}
+        if isinstance(value, (type, types.FunctionType)):
+            name = "{0}.{1}".format(value.__module__, value.__name__)
+            if getattr(sys.modules.get(value.__module__), value.__name__,
+                       None) is value:
+                return {"$ref": name}
+        raise TypeError("{0!r} can not be saved in a scene file".format(value))
+
+    def rgb(self, col_rgb):
+        entry = self.rgb_index.get(id(col_rgb))
+        if entry is None:
+            i = self.string(json.dumps(self.encode(list(col_rgb))))
+            entry = self.rgb_index[id(col_rgb)] = (i, col_rgb)
+        return entry[0]
+
+    def dependencies(self, obj, info):
+        """Objects that should be written before obj: its childs and
+        the parts used as parameters"""
+        deps = list(obj.childs) if info[1] else []
+        if not info[3]:
+            deps.extend(_parts_in([value for name, value in obj.__dict__.items()
+                                   if name[0] != "_" and name not in _NODE_ATTRS]))
+        return [d for d in deps if id(d) not in self.written]
+
+    def write(self, root):
+        """Add the nodes of the root tree. The childs are added first"""
+
+        #-- Iterative post-order traversal (the trees can be deep)
+        pending = [(root, False)]
+        visiting = set()
+        while pending:
+            obj, ready = pending.pop()
+            if id(obj) in self.written:
+                continue
+
+            info = self.class_info(obj)
+            if not ready and (info[1] or not info[3]):
+                if id(obj) in visiting:
+                    raise ValueError("The part tree has cycles")
+                deps = self.dependencies(obj, info)
+                if deps:
+                    visiting.add(id(obj))
+                    pending.append((obj, True))
+                    pending.extend((d, False) for d in reversed(deps))
+                    continue
+
+            childs = obj.childs if info[1] else ()
+            child0 = len(self.childs)
+            if childs:
+                self.childs.extend([self.written[id(c)] for c in childs])
+
+            mat0, nmats = 0, 0
+            if info[2]:
+                mat0, nmats = len(self.matrices), len(obj.transforms)
+                self.matrices.extend(obj.transforms)
+
+            T = -1
+            if obj.T is not trans.IDENTITY:
+                T = len(self.matrices)
+                self.matrices.append(obj.T)
+
+            layout, params = self.params(obj, info)
+            self.nodes.append((
+                info[0], layout, params, T,
+                self.string(obj.col),
+                self.rgb(obj.col_rgb),
+                obj.alpha,
+                (1 if obj.debug else 0) | (2 if obj.show_frame else 0),
+                child0, len(childs), mat0, nmats))
+            self.written[id(obj)] = len(self.nodes) - 1
+
+
+def save(obj, fname):
+    """Save the obj part tree in the fname scene file"""
+
+    w = _Writer()
+    with _no_gc():
+        w.write(obj)
+
+    arrays = [
+        ("nodes", np.array(w.nodes, dtype=NODE_DTYPE)),
+        ("childs", np.array(w.childs, dtype="<i4")),
+        ("matrices", np.array(w.matrices, dtype="<f8").reshape(-1, 4, 4)),
+        ("numbers", np.array(w.numbers, dtype="<f8")),
+        ("offsets", np.cumsum([0] + [len(s) for s in w.strings]).astype("<i8")),
+        ("strings", np.frombuffer("".join(w.strings), dtype="u1")),
+    ]
+
+    #-- Position of the arrays after the header
+    header = {"version": VERSION, "classes": w.classes,
+              "layouts": w.layouts, "arrays": {}}
+    pos = 0
+    for name, a in arrays:
+        header["arrays"][name] = [pos, a.shape]
+        pos += (a.nbytes + 7) & ~7
+    hdr = json.dumps(header)
+    hdr += " " * (-(len(MAGIC) + 8 + len(hdr)) % 8)
+
+    #-- The file is written in a temporary file and then renamed: the
+    #-- processes that have the old file memory-mapped keep its content
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)),
+                               suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(hdr)))
+            f.write(hdr)
+            for name, a in arrays:
+                f.write(a.tostring())
+                f.write("\0" * (-a.nbytes % 8))
+        os.chmod(tmp, 0o666 & ~_umask())
+        os.rename(tmp, fname)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _read_arrays(fname, mmap):
+    """Return the header and the arrays of the file"""
+
+    #-- Plain arrays (views of the memmap)
+    data = np.asarray(np.memmap(fname, dtype="u1", mode="r") if mmap else
+                      np.fromfile(fname, dtype="u1"))
+    data.flags.writeable = False
+
+    if data[:len(MAGIC)].tostring() != MAGIC:
+        raise ValueError("{0} is not a pyooml scene file".format(fname))
+
+    n = struct.unpack("<Q", data[len(MAGIC):len(MAGIC) + 8].tostring())[0]
+    start = len(MAGIC) + 8 + n
+    header = json.loads(data[len(MAGIC) + 8:start].tostring())
+
+    if header.get("version") != VERSION:
+        raise ValueError("{0}: scene file version {1} is not supported "
+                         "(only {2})".format(fname, header.get("version"),
+                                             VERSION))
+
+    arrays = {}
+    for name, (pos, shape) in header["arrays"].items():
+        dtype = ARRAY_DTYPES[name]
+        count = int(np.prod(shape))
+        a = data[start + pos:start + pos + count * dtype.itemsize]
+        arrays[name] = a.view(dtype).reshape(shape)
+    return header, arrays
+
+
+def _import(name):
+    """Return the module level object of the "module.name" name"""
+    module, name = str(name).rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def _part_class(name):
+    cls = _import(name)
+    if not (isinstance(cls, type) and issubclass(cls, part)):
+        raise ValueError("{0} is not a part class".format(name))
+    return cls
+
+
+class _Decoder(object):
+    """Values of the json parameters"""
+
+    def __init__(self, objs):
+        self.objs = objs
+
+    def decode(self, value):
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        if isinstance(value, list):
+            return [self.decode(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+
+        if "$node" in value:
+            return self.objs[value["$node"]]
+        if "$tuple" in value:
+            return tuple(self.decode(v) for v in value["$tuple"])
+        if "$dict" in value:
+            return dict((self.decode(k), self.decode(v))
+                        for k, v in value["$dict"])
+        if "$array" in value:
+            return np.array(value["$array"], dtype=str(value["dtype"]))
+        if "$ref" in value:
+            obj = _import(value["$ref"])
+            if not callable(obj):
+                raise ValueError("{0} is not callable".format(value["$ref"]))
+            return obj
+        raise ValueError("Unknown parameter value: {0!r}".format(value))
+
+
+def load(fname, mmap=True):
+    """Load the part tree saved in the fname scene file.
+    mmap: map the file in memory instead of reading it. The matrices
+          of the parts are views of the file. They are read only, like
+          the matrices of all the parts"""
+
+    header, a = _read_arrays(fname, mmap)
+    nodes, childs = a["nodes"], a["childs"]
+    matrices = list(a["matrices"])
+    numbers = a["numbers"].tolist()
+    offsets = a["offsets"].tolist()
+    blob = a["strings"].tostring()
+
+    classes = [_part_class(name) for name in header["classes"]]
+    objs = []
+    decoder = _Decoder(objs)
+
+    strings = {}
+    def string(i):
+        s = strings.get(i)
+        if s is None:
+            s = strings[i] = blob[offsets[i]:offsets[i + 1]]
+        return s
+
+    #-- The colors are shared by the nodes: read only
+    rgbs = {}
+    def rgb(i):
+        value = rgbs.get(i)
+        if value is None:
+            value = rgbs[i] = pyooml._frozen_list(
+                decoder.decode(json.loads(string(i))))
+        return value
+
+    #-- Parameters: list of (setter, value), by (layout, params). The
+    #-- frozen attributes (size...) are converted once
+    setattr_ = object.__setattr__
+    def freeze(name, value):
+        f = pyooml._FREEZE.get(name)
+        return value if f is None else f(value)
+
+    layouts = []
+    for cls_i, fields in header["layouts"]:
+        cls = classes[cls_i]
+        layouts.append([(getattr(cls, str(name)).__set__, is_list,
+                         [_CONVERT[k] for k in kinds], str(name))
+                        for name, is_list, kinds in fields])
+
+    params = {}
+    def get_params(layout, i):
+        p = params.get((layout, i))
+        if p is not None:
+            return p
+        if layout < 0:
+            p = [(lambda obj, value, name=str(name): setattr_(obj, name, value),
+                  freeze(str(name), decoder.decode(value)))
+                 for name, value in json.loads(string(i))]
+        else:
+            p = []
+            j = i
+            for setter, is_list, convert, name in layouts[layout]:
+                if is_list:
+                    value = [c(v) for c, v in
+                             zip(convert, numbers[j:j + len(convert)])]
+                    p.append((setter, freeze(name, value)))
+                else:
+                    p.append((setter, convert[0](numbers[j])))
+                j += len(convert)
+        params[(layout, i)] = p
+        return p
+
+    #-- The attributes of the nodes are set with the slot descriptors
+    #-- (faster than setattr). The constructors are not executed
+    slots = part.__dict__
+    set_T, set_col, set_rgb, set_alpha, set_debug, set_frame = [
+        slots[name].__set__ for name in
+        ("T", "col", "col_rgb", "alpha", "debug", "show_frame")]
+    set_cached, set_fp, set_bbox, set_parents = [
+        slots[name].__set__ for name in ("_cached", "_fp", "_bbox", "_parents")]
+    new = object.__new__
+    flag_values = [(False, False), (True, False), (False, True), (True, True)]
+
+    columns = [nodes[name].tolist() for name in NODE_DTYPE.names]
+    cols = dict((i, string(i)) for i in set(columns[4]))
+    colors = dict((i, rgb(i)) for i in set(columns[5]))
+
+    #-- The index -1 is the identity
+    matrices.append(trans.IDENTITY)
+
+    #-- Per class: operator, instances, only the default cached data
+    kinds = [(issubclass(cls, operator), issubclass(cls, instances),
+              cls._caches is part._caches) for cls in classes]
+
+    with _no_gc():
+        for (cls_i, layout, params_i, T_i, col_i, rgb_i, alpha, flags,
+             child0, nchilds, mat0, nmats) in itertools.izip(*columns):
+
+            cls = classes[cls_i]
+            obj = new(cls)
+            p = params.get((layout, params_i))
+            if p is None:
+                p = get_params(layout, params_i)
+            for setter, value in p:
+                setter(obj, value)
+
+            set_T(obj, matrices[T_i])
+            set_col(obj, cols[col_i])
+            set_rgb(obj, colors[rgb_i])
+            set_alpha(obj, alpha)
+            debug, show_frame = flag_values[flags & 3]
+            set_debug(obj, debug)
+            set_frame(obj, show_frame)
+
+            #-- No cached data
+            set_parents(obj, None)
+            is_operator, is_instances, default_caches = kinds[cls_i]
+            if default_caches:
+                set_fp(obj, None)
+                set_bbox(obj, None)
+                set_cached(obj, False)
+            else:
+                obj._invalidate()
+
+            if is_operator:
+                ids = childs[child0:child0 + nchilds].tolist()
+                setattr_(obj, "childs", tuple([objs[c] for c in ids]))
+            if is_instances:
+                setattr_(obj, "transforms", a["matrices"][mat0:mat0 + nmats])
+
+            objs.append(obj)
+
+    return objs[-1]
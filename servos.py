@@ -61,6 +61,10 @@ class Servo(combinational):
         
         #-- Call the parent calls constructor
         super(Servo, self).__init__()
+
+    def _geometry_key(self):
+        #-- The geometry is defined by the servo class and its color
+        return (tuple(self.col_rgb), self.alpha)
         
 
     def _geometry(self):
@@ -99,12 +103,29 @@ class Servo(combinational):
         dh = drill height
         """
 
-        l = [cylinder(r = self.drills_diam / 2., h = dh).Tras(p)
-             for p in self.drills_pos]
+        drill = cylinder(r = self.drills_diam / 2., h = dh)
+
+        return instances(drill, self.drills_pos)
 
-        obj = union(l)
 
-        return obj
+def servo_ring(servo):
+    """Ring for fixing the servo by its ears"""
+
+    thick_z = 4
+    thick_xy = servo.ear_size[0] + 4
+    tolerance = 0.2
+    
+    #-- Get the servo body dimensions
+    sx, sy, sz = servo.body_size + np.array([tolerance, tolerance, 0])
+    
+    #-- Cutout: servo body + tolerance
+    cutout = bcube([sx, sy, sz],cr = servo.body_cr, cres = servo.body_cres)
+    
+    #-- Add the tolerance to the 
+    
+    obj = bcube([sx + 2*thick_xy + 2*tolerance, sy + thick_xy + 2*tolerance, thick_z])
+    
+    return (obj - cutout - servo.drills(dh=10)).Tras([0,0,-thick_z/2 + servo.ear_hi_center])
 
 
 class Futaba3003(Servo):
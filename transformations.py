@@ -1,4 +1,6 @@
+import math
 import numpy as np
+import itertools
 
 def unit(v):
     """return the unit vector"""
@@ -20,9 +22,59 @@ def Identity():
          [ 0.,  1.,  0.,  0.],
          [ 0.,  0.,  1.,  0.],
          [ 0.,  0.,  0.,  1.]])
+
+#-- Read only identity matrix, shared by all the untransformed objects
+IDENTITY = Identity()
+IDENTITY.flags.writeable = False
          
+def _axis_rot_key(a, k):
+    """Return the key of the rotation in the cache of axis aligned
+    rotations (multiples of 90 degrees around X, Y or Z).
+    None if it is not one of them"""
+
+    if a % 90 != 0:
+        return None
+
+    nonzero = [i for i in range(3) if k[i] != 0]
+    if len(nonzero) != 1:
+        return None
+
+    #-- Rotating around -X is the same than rotating -a around X
+    i = nonzero[0]
+    sign = 1 if k[i] > 0 else -1
+    return (int(sign * a) % 360, i)
+
+#-- Cache of axis aligned rotations. They are read only
+_axis_rots = {}
+
 def Rot(a, k):
     """Rotation an angle a around the k axis"""
+    R = rotation(a, k)
+    return R.copy() if not R.flags.writeable else R
+
+def rotation(a, k):
+    """Rotation an angle a around the k axis, without copies: the axis
+    aligned rotations are shared read only matrices. For the callers
+    that do not modify the result (ex. R.dot(T))"""
+
+    #-- Common rotations (multiples of 90 degrees around the axes)
+    #-- are calculated only once, and they are exact
+    key = _axis_rot_key(a, k)
+    if key is not None:
+        try:
+            return _axis_rots[key]
+        except KeyError:
+            axis = [0, 0, 0]
+            axis[key[1]] = 1
+            R = np.round(_Rot(key[0], axis)) + 0.   #-- No -0.
+            R.flags.writeable = False
+            _axis_rots[key] = R
+            return R
+
+    return _Rot(a, k)
+
+def _Rot(a, k):
+    """Rotation an angle a around the k axis (no cache)"""
     
     #-- The rotation axis should be defined by a unit vector
     k = unit(k)
@@ -42,3 +94,199 @@ def Rot(a, k):
          [ kx * ky * V + kz * S,  ky * ky * V + C,       ky * kz * V - kx * S,  0.],
          [ kx * kz * V - ky * S,  ky * kz * V + kx * S,  kz * kz * V + C,       0.],
          [ 0.,  0.,  0.,  1.]])
+
+def Tras_array(vts):
+    """Homogeneous matrices for the translations to the points vts.
+    vts: (N,3) array. It returns an (N,4,4) array"""
+
+    vts = np.asarray(vts, dtype=float)
+    M = np.tile(Identity(), (len(vts), 1, 1))
+    M[:, :3, 3] = vts
+    return M
+
+def Rot_array(a, k):
+    """Rotations of the angles a around the k axes.
+    a: (N,) array of angles (in degrees)
+    k: rotation axis (3,) or (N,3) array of axes
+    It returns an (N,4,4) array"""
+
+    a = np.radians(np.asarray(a, dtype=float))
+    k = np.asarray(k, dtype=float)
+    if k.ndim == 1:
+        k = np.tile(k, (len(a), 1))
+
+    #-- The rotation axes should be defined by unit vectors
+    k = k / np.linalg.norm(k, axis=1)[:, np.newaxis]
+    kx, ky, kz = k.T
+
+    C = np.cos(a)
+    V = 1. - C
+    S = np.sin(a)
+
+    M = np.zeros((len(a), 4, 4))
+    M[:, 0, 0] = kx * kx * V + C
+    M[:, 0, 1] = kx * ky * V - kz * S
+    M[:, 0, 2] = kx * kz * V + ky * S
+    M[:, 1, 0] = kx * ky * V + kz * S
+    M[:, 1, 1] = ky * ky * V + C
+    M[:, 1, 2] = ky * kz * V - kx * S
+    M[:, 2, 0] = kx * kz * V - ky * S
+    M[:, 2, 1] = ky * kz * V + kx * S
+    M[:, 2, 2] = kz * kz * V + C
+    M[:, 3, 3] = 1.
+    return M
+
+#----------------- Quaternions: arrays (..., 4) of [w, x, y, z]
+
+def _units(v):
+    """Unit vectors of the (..., 3) array v"""
+    v = np.asarray(v, dtype=float)
+    return v / np.linalg.norm(v, axis=-1)[..., np.newaxis]
+
+def quat_axis_angle(k, a):
+    """Quaternions of the rotations of the angles a (degrees) around
+    the k axes. k: (..., 3) array. a: scalar or array"""
+    k = _units(k)
+    half = np.radians(np.asarray(a, dtype=float)) / 2.
+    S = np.sin(half)
+    return np.stack(np.broadcast_arrays(np.cos(half), S * k[..., 0],
+                                        S * k[..., 1], S * k[..., 2]), axis=-1)
+
+def quat_from_to(u, v):
+    """Quaternions of the shortest rotations that take the u vectors
+    to the v directions. u, v: (..., 3) arrays.
+    They are not normalized: q = [1 + u.v, u x v], with u, v unit
+    vectors, so that the axis aligned cases are exact. When u and v
+    are opposite, the rotation is around an axis perpendicular to u"""
+
+    u, v = _units(u), _units(v)
+    ux, uy, uz = u[..., 0], u[..., 1], u[..., 2]
+    vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+    w = 1. + ux * vx + uy * vy + uz * vz
+    q = np.stack(np.broadcast_arrays(w, uy * vz - uz * vy, uz * vx - ux * vz,
+                                     ux * vy - uy * vx), axis=-1)
+
+    #-- Opposite vectors (180 degrees): rotation around the axis
+    #-- perpendicular to u in the XY plane (the Y axis if u is Z)
+    opposite = q[..., 0] < 1e-12
+    if opposite.any():
+        uo = np.broadcast_to(u, q[..., 1:].shape)[opposite]
+        axis = np.zeros_like(uo)
+        axis[:, 0] = -uo[:, 1]
+        axis[:, 1] = uo[:, 0]
+        axis[(axis * axis).sum(axis=-1) < 1e-24] = [0., 1., 0.]
+        q[opposite] = 0.
+        q[..., 1:][opposite] = _units(axis)
+    return q
+
+def quat_mul(q1, q2):
+    """Product of quaternions (the q2 rotation and then q1)"""
+    q1 = np.asarray(q1, dtype=float)
+    q2 = np.asarray(q2, dtype=float)
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w2, x2, y2, z2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=-1)
+
+def quat_matrix(q):
+    """Homogeneous matrices (..., 4, 4) of the quaternions q (they do
+    not need to be normalized)"""
+
+    q = np.asarray(q, dtype=float)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    s = 2. / (w * w + x * x + y * y + z * z)
+
+    M = np.zeros(q.shape[:-1] + (4, 4))
+    M[..., 0, 0] = 1. - s * (y * y + z * z)
+    M[..., 0, 1] = s * (x * y - w * z)
+    M[..., 0, 2] = s * (x * z + w * y)
+    M[..., 1, 0] = s * (x * y + w * z)
+    M[..., 1, 1] = 1. - s * (x * x + z * z)
+    M[..., 1, 2] = s * (y * z - w * x)
+    M[..., 2, 0] = s * (x * z - w * y)
+    M[..., 2, 1] = s * (y * z + w * x)
+    M[..., 2, 2] = 1. - s * (x * x + y * y)
+    M[..., 3, 3] = 1.
+
+    #-- Rounding errors of the exact values (0, 1, -1). They
+    #-- would appear in the openscad code
+    R = M[..., :3, :3]
+    r = np.round(R)
+    snap = np.abs(R - r) < 1e-14
+    R[snap] = r[snap] + 0.   #-- No -0.
+    return M
+
+def Orien_array(v, vref=[0., 0., 1.], roll=0.):
+    """Homogeneous matrices for orienting vref in the v directions and
+    then rotating the roll angles around v.
+    v: (N,3) array. vref: (3,) or (N,3) array. roll: scalar or (N,) array
+    It returns an (N,4,4) array. Ex. orienting a part to many directions:
+
+      instances(part, Orien_array(directions))
+    """
+    return quat_matrix(quat_mul(quat_axis_angle(v, roll),
+                                quat_from_to(vref, v)))
+
+def Orien(v, vref=[0., 0., 1.], roll=0.):
+    """Homogeneous matrix for orienting the vector vref in the v direction
+    and then rotating an angle roll around v"""
+
+    if np.ndim(v) > 1 or np.ndim(vref) > 1 or np.ndim(roll) > 0:
+        return Orien_array(v, vref, roll)
+
+    #-- Only one matrix: the same quaternions, calculated with floats
+    vx, vy, vz = v
+    ux, uy, uz = vref
+    nv = math.sqrt(vx * vx + vy * vy + vz * vz)
+    nu = math.sqrt(ux * ux + uy * uy + uz * uz)
+    vx, vy, vz = vx / nv, vy / nv, vz / nv
+    ux, uy, uz = ux / nu, uy / nu, uz / nu
+
+    w = 1. + ux * vx + uy * vy + uz * vz
+    if w < 1e-12:
+        w, x, y, z = quat_from_to(vref, v)
+    else:
+        x, y, z = uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx
+
+    half = math.radians(roll) / 2.
+    c, S = math.cos(half), math.sin(half)
+    rx, ry, rz = S * vx, S * vy, S * vz
+
+    return quat_matrix([c * w - rx * x - ry * y - rz * z,
+                        c * x + rx * w + ry * z - rz * y,
+                        c * y - rx * z + ry * w + rz * x,
+                        c * z + rx * y - ry * x + rz * w])
+
+#-- Indexes of the 8 corners of a box (0: min, 1: max)
+_corners = np.array(list(itertools.product([0, 1], repeat=3)))
+
+def bbox_transform(M, box):
+    """Bounding box of the box after applying the transformation M
+    box: [[xmin, ymin, zmin], [xmax, ymax, zmax]]
+    M: homogeneous matrix (4,4) or array of matrices (N,4,4). In that
+       case the bounding box of all the transformed boxes is returned"""
+
+    box = np.asarray(box, dtype=float)
+    corners = box[_corners, [0, 1, 2]]
+
+    #-- Transform all the corners at once
+    pts = (np.einsum('...ij,kj->...ki', M[..., :3, :3], corners) +
+           M[..., np.newaxis, :3, 3]).reshape(-1, 3)
+
+    return np.array([pts.min(axis=0), pts.max(axis=0)])
+
+def bboxes_transform(Ms, boxes):
+    """Bounding boxes of N boxes, each one transformed by its matrix
+    Ms: (N,4,4) array of matrices
+    boxes: (N,2,3) array of boxes
+    It returns an (N,2,3) array"""
+
+    boxes = np.asarray(boxes, dtype=float)
+    corners = boxes[:, _corners, [0, 1, 2]]       #-- (N,8,3)
+
+    pts = (np.einsum('nij,nkj->nki', Ms[:, :3, :3], corners) +
+           Ms[:, np.newaxis, :3, 3])
+
+    return np.stack([pts.min(axis=1), pts.max(axis=1)], axis=1)
@@ -1,26 +1,188 @@
-import pyinotify
-import os;
+#!/usr/bin/python
+#-------------------------------------------------------------
+#-- Pyooml: Python Object Oriented Mechanics Library
+#-------------------------------------------------------------
+#-- Watcher: rebuild the design every time the user saves it
+#--
+#-- Usage: python watch.py [script.py]   (default: main.py)
+#--
+#-- The interpreter and the library are kept loaded between
+#-- builds: only the modified user modules are reloaded, and the
+#-- geometry and openscad code of the parts that have not changed
+#-- are reused (caches).
+#-- The script is expected to call show(), which only rewrites
+#-- the output file if its content changes
+#-------------------------------------------------------------
+#-- GPL licence
+#-------------------------------------------------------------
 
+import os
+import sys
+import time
+import runpy
+import traceback
 
-class EventHandler(pyinotify.ProcessEvent):
-    def process_IN_CLOSE_WRITE(self, event):
-        print "Modify!!", event.pathname
-        os.system("python main.py > test.scad")
+#-- Load the library (it is kept warm between builds)
+import pyooml
+import combinational
 
-# Instanciate a new WatchManager (will be used to store watches).
-wm = pyinotify.WatchManager()
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
 
-handler = EventHandler()
+#-- Keep the openscad code of the subtrees between builds, and
+#-- between restarts (disk cache)
+pyooml.set_fragment_cache_size(50000)
+if pyooml.disk_cache is None:
+    pyooml.set_disk_cache()
 
-# Associate this WatchManager with a Notifier (will be used to report and
-# process events).
-notifier = pyinotify.Notifier(wm, handler)
+#-- Library modules. If they change the watcher is restarted
+LIBRARY = set(["pyooml", "primitive", "combinational", "operators",
+               "transformations", "utils", "cache", "parallel",
+               "openscad", "instrument", "scene", "mesh", "bvh"])
 
 
-# Add a new watch on /tmp for ALL_EVENTS.
-wm.add_watch('./main.py', pyinotify.IN_CLOSE_WRITE)
+class Rebuilder(object):
+    """Re-execute the user script when its files are modified"""
 
+    def __init__(self, script, debounce=0.3):
+        """
+        script: User script to execute
+        debounce: Time (in sec) without modifications before rebuilding.
+                  The editors usually write several times when saving
+        """
+        self.script = os.path.abspath(script)
+        self.debounce = debounce
+        self.pending = set()
+        self.last = 0
 
-# Loop forever and handle events.
-notifier.loop()
+    def changed(self, path):
+        """Notify that the path file has been modified"""
+        print "Modify!!", path
+        self.pending.add(os.path.abspath(path))
+        self.last = time.time()
 
+    def poll(self):
+        """Rebuild if there are modifications and the writes are over"""
+        if self.pending and time.time() - self.last >= self.debounce:
+            self.rebuild()
+
+    def _module(self, path):
+        """Return the loaded module of the path file (or None)"""
+        base = os.path.splitext(path)[0]
+        for name, mod in sys.modules.items():
+            fname = getattr(mod, "__file__", None)
+            if fname and os.path.splitext(os.path.abspath(fname))[0] == base:
+                return mod
+        return None
+
+    def rebuild(self):
+        paths, self.pending = self.pending, set()
+
+        #-- Reload the user modules that have changed
+        reloaded = False
+        for path in paths:
+            mod = self._module(path)
+            if mod is None:
+                continue
+
+            if mod.__name__ in LIBRARY:
+                print "Library modified: restarting"
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+
+            try:
+                reload(mod)
+            except Exception:
+                traceback.print_exc()
+                return
+            reloaded = True
+
+        #-- The cached geometries and code can depend on the reloaded
+        #-- modules (ex. helper functions called by the part classes)
+        #-- without changing their keys. Only the script changes keep them
+        if reloaded:
+            combinational.geometry_cache.clear()
+            pyooml.fragment_cache.clear()
+
+        self.run()
+
+    def run(self):
+        """Execute the user script"""
+        t0 = time.time()
+        try:
+            runpy.run_path(self.script, run_name="__main__")
+        except SystemExit:
+            pass
+        except Exception:
+            traceback.print_exc()
+            return
+
+        print "Build: {0:.3f} sec".format(time.time() - t0)
+        print "  Geometry cache: {0}".format(combinational.geometry_cache.stats())
+        print "  Fragment cache: {0}".format(pyooml.fragment_cache.stats())
+        if pyooml.disk_cache is not None:
+            print "  Disk cache: {0}".format(pyooml.disk_cache.stats())
+
+
+def watch_inotify(rebuilder, path):
+
+    class EventHandler(pyinotify.ProcessEvent):
+        def process_IN_CLOSE_WRITE(self, event):
+            if event.pathname.endswith(".py"):
+                rebuilder.changed(event.pathname)
+
+        #-- Some editors save in another file and then rename it
+        process_IN_MOVED_TO = process_IN_CLOSE_WRITE
+
+    wm = pyinotify.WatchManager()
+    notifier = pyinotify.Notifier(wm, EventHandler(), timeout=100)
+    wm.add_watch(path, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+
+    while True:
+        if notifier.check_events():
+            notifier.read_events()
+            notifier.process_events()
+        rebuilder.poll()
+
+
+def watch_polling(rebuilder, path, period=0.2):
+    """Used when pyinotify is not available"""
+
+    def mtimes():
+        result = {}
+        for f in os.listdir(path):
+            if not f.endswith(".py"):
+                continue
+            try:
+                result[f] = os.stat(os.path.join(path, f)).st_mtime
+            except OSError:
+                #-- Removed after listing it (ex. editor temporary files)
+                continue
+        return result
+
+    last = mtimes()
+    while True:
+        time.sleep(period)
+        current = mtimes()
+        for f, mtime in current.items():
+            if last.get(f) != mtime:
+                rebuilder.changed(os.path.join(path, f))
+        last = current
+        rebuilder.poll()
+
+
+if __name__ == "__main__":
+    script = sys.argv[1] if len(sys.argv) > 1 else "main.py"
+    path = os.path.dirname(os.path.abspath(script))
+
+    #-- The user modules are imported from the script directory
+    sys.path.insert(0, path)
+
+    rebuilder = Rebuilder(script)
+    rebuilder.run()
+
+    if pyinotify:
+        watch_inotify(rebuilder, path)
+    else:
+        watch_polling(rebuilder, path)